@@ -0,0 +1,22 @@
+"""add status column to files
+
+Revision ID: add_file_status
+Revises: add_share_indexes
+Create Date: 2026-10-15 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_file_status'
+down_revision = 'add_share_indexes'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Existing files are already in S3, so they start out as 'ready'
+    op.add_column('files', sa.Column('status', sa.String(), server_default='ready', nullable=True))
+
+def downgrade():
+    op.drop_column('files', 'status')
@@ -0,0 +1,28 @@
+"""add is_deleted to the files owner/parent index
+
+Revision ID: add_is_deleted_to_files_index
+Revises: add_file_status
+Create Date: 2026-10-15 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_is_deleted_to_files_index'
+down_revision = 'add_file_status'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction block
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_files_owner_parent', table_name='files', postgresql_concurrently=True)
+        op.create_index('ix_files_owner_parent', 'files', ['owner_id', 'parent_id', 'is_deleted'],
+                        postgresql_concurrently=True)
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_files_owner_parent', table_name='files', postgresql_concurrently=True)
+        op.create_index('ix_files_owner_parent', 'files', ['owner_id', 'parent_id'],
+                        postgresql_concurrently=True)
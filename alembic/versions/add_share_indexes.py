@@ -0,0 +1,40 @@
+"""add indexes for file listing and share lookups
+
+Revision ID: add_share_indexes
+Revises: add_is_deleted_column
+Create Date: 2026-10-15 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_share_indexes'
+down_revision = 'add_is_deleted_column'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Remove duplicate shares so the unique index can be built, keeping the oldest row
+    op.execute('''
+        DELETE FROM file_shares a
+        USING file_shares b
+        WHERE a.file_id = b.file_id
+          AND a.shared_with_id = b.shared_with_id
+          AND a.id > b.id
+    ''')
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    with op.get_context().autocommit_block():
+        op.create_index('ix_files_owner_parent', 'files', ['owner_id', 'parent_id'],
+                        postgresql_concurrently=True)
+        op.create_index('ix_shares_file_user', 'file_shares', ['file_id', 'shared_with_id'],
+                        unique=True, postgresql_concurrently=True)
+        op.create_index('ix_shares_user_date', 'file_shares', ['shared_with_id', sa.text('share_date DESC')],
+                        postgresql_concurrently=True)
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_shares_user_date', table_name='file_shares', postgresql_concurrently=True)
+        op.drop_index('ix_shares_file_user', table_name='file_shares', postgresql_concurrently=True)
+        op.drop_index('ix_files_owner_parent', table_name='files', postgresql_concurrently=True)
@@ -0,0 +1,23 @@
+"""add content_hash column to file_versions
+
+Revision ID: add_version_content_hash
+Revises: add_is_deleted_to_files_index
+Create Date: 2026-10-15 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_version_content_hash'
+down_revision = 'add_is_deleted_to_files_index'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Hex blake2b digest with digest_size=16 (versioning.hash_file), so 32 characters.
+    # Existing versions have no hash; they are simply never matched for dedup
+    op.add_column('file_versions', sa.Column('content_hash', sa.String(32), nullable=True))
+
+def downgrade():
+    op.drop_column('file_versions', 'content_hash')
@@ -0,0 +1,25 @@
+"""add file_versions (file_id, version_number) index
+
+Revision ID: add_version_history_index
+Revises: add_version_content_hash
+Create Date: 2026-10-15 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_version_history_index'
+down_revision = 'add_version_content_hash'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    with op.get_context().autocommit_block():
+        op.create_index('ix_fileversion_file_version', 'file_versions', ['file_id', sa.text('version_number DESC')],
+                        postgresql_concurrently=True)
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_fileversion_file_version', table_name='file_versions', postgresql_concurrently=True)
@@ -4,9 +4,10 @@ from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, make_transient_to_detached
 from .. import models, schemas
 from ..database import get_db
+from ..utils.cache import cache_get, cache_set, cache_delete
 import os
 from dotenv import load_dotenv
 
@@ -16,12 +17,14 @@ load_dotenv()
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-here")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# How long a resolved user is cached; bounds how stale is_active can be outside admin routes
+USER_CACHE_TTL_SECONDS = 60
 
 # Configure password hashing with explicit bcrypt settings
 pwd_context = CryptContext(
     schemes=["bcrypt"],
     deprecated="auto",
-    bcrypt__rounds=12,  # Use a fixed number of rounds
+    bcrypt__rounds=int(os.getenv("BCRYPT_ROUNDS", "12")),  # Fixed cost; tests lower it
     bcrypt__ident="2b"  # Use the 2b version of bcrypt
 )
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
@@ -42,6 +45,13 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def user_cache_key(user_id: int) -> str:
+    return f"user:{user_id}"
+
+def invalidate_cached_user(user_id: int):
+    """Drop a user from the auth cache after it is updated or deleted"""
+    cache_delete(user_cache_key(user_id))
+
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     print("[DEBUG] Decoding token:", token)
     credentials_exception = HTTPException(
@@ -59,10 +69,27 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
     except JWTError as e:
         print("[DEBUG] JWTError:", e)
         raise credentials_exception
+    cached = cache_get(user_cache_key(user_id))
+    if cached is not None:
+        # Attach the cached columns to this session without a query; anything not cached
+        # (hashed_password, relationships) is lazy-loaded from the database on access
+        cached["created_at"] = datetime.fromisoformat(cached["created_at"]) if cached["created_at"] else None
+        user = models.User(**cached)
+        make_transient_to_detached(user)
+        return db.merge(user, load=False)
     user = db.query(models.User).filter(models.User.id == user_id).first()
     print("[DEBUG] User from DB:", user)
     if user is None:
         raise credentials_exception
+    cache_set(user_cache_key(user_id), {
+        "id": user.id,
+        "email": user.email,
+        "username": user.username,
+        "is_active": user.is_active,
+        "is_admin": user.is_admin,
+        "created_at": user.created_at,
+        "auth_uuid": user.auth_uuid
+    }, USER_CACHE_TTL_SECONDS)
     return user
 
 def get_current_active_user(current_user: models.User = Depends(get_current_user)):
@@ -71,8 +98,18 @@ def get_current_active_user(current_user: models.User = Depends(get_current_user
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
 
-def get_current_admin_user(current_user: models.User = Depends(get_current_active_user)):
-    if not current_user.is_admin:
+def get_current_admin_user(
+    current_user: models.User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    # The cached flags can lag a change made outside the API (or a failed cache delete) by up
+    # to USER_CACHE_TTL_SECONDS, so admin routes re-read them from the database
+    flags = db.query(models.User.is_active, models.User.is_admin).filter(
+        models.User.id == current_user.id
+    ).first()
+    if flags is not None and not flags.is_active:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    if flags is None or not flags.is_admin:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not enough permissions"
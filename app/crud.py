@@ -1,4 +1,5 @@
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, raiseload
+from sqlalchemy.dialects import postgresql, sqlite
 from . import models, schemas
 from typing import List, Optional
 from datetime import datetime
@@ -27,8 +28,25 @@ def create_user(db: Session, user: schemas.UserCreate):
 def get_file(db: Session, file_id: int):
     return db.query(models.File).filter(models.File.id == file_id).first()
 
+def get_file_access(db: Session, file_id: int):
+    """Get only the columns needed to authorize and serve a file, as a single row"""
+    return db.query(
+        models.File.id,
+        models.File.owner_id,
+        models.File.is_shared,
+        models.File.type,
+        models.File.mime_type,
+        models.File.file_type,
+        models.File.file_path,
+        models.File.filename,
+        models.File.file_size,
+        models.File.status
+    ).filter(models.File.id == file_id).first()
+
 def get_user_files(db: Session, user_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.File).filter(
+    """List a page of the user's files. List serializers only read columns, so
+    relationships are set to raise rather than lazy-load one row at a time"""
+    return db.query(models.File).options(raiseload("*")).filter(
         models.File.owner_id == user_id
     ).offset(skip).limit(limit).all()
 
@@ -62,8 +80,27 @@ def create_file_share(db: Session, file_id: int, share: schemas.FileShareCreate)
     db.refresh(db_share)
     return db_share
 
+def upsert_file_shares(db: Session, file_ids: List[int], shared_with_id: int, permission: str):
+    """Share files with a user in one statement, updating the permission of existing shares.
+
+    Relies on the unique (file_id, shared_with_id) index. The caller commits.
+    """
+    if not file_ids:
+        return
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    stmt = dialect.insert(models.FileShare).values([
+        {"file_id": file_id, "shared_with_id": shared_with_id, "permission": permission}
+        for file_id in file_ids
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.FileShare.file_id, models.FileShare.shared_with_id],
+        set_={"permission": stmt.excluded.permission}
+    )
+    db.execute(stmt)
+
 def get_shared_files(db: Session, user_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.File).join(
+    """List a page of files shared with the user, without lazy-loading relationships"""
+    return db.query(models.File).options(raiseload("*")).join(
         models.FileShare
     ).filter(
         models.FileShare.shared_with_id == user_id
@@ -73,7 +110,6 @@ def create_file_version(db: Session, file_id: int, version: schemas.FileVersionC
     db_version = models.FileVersion(
         **version.dict(),
         file_id=file_id,
-        created_by=user_id,
         created_at=datetime.utcnow()
     )
     db.add(db_version)
@@ -82,6 +118,16 @@ def create_file_version(db: Session, file_id: int, version: schemas.FileVersionC
     return db_version
 
 def get_file_versions(db: Session, file_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.FileVersion).filter(
+    """Get a file's versions as plain rows, ready to be serialized without the ORM"""
+    return db.query(
+        models.FileVersion.id,
+        models.FileVersion.file_id,
+        models.FileVersion.version_number,
+        models.FileVersion.file_path,
+        models.FileVersion.file_size,
+        models.FileVersion.created_at,
+        models.FileVersion.comment,
+        models.FileVersion.is_current
+    ).filter(
         models.FileVersion.file_id == file_id
     ).offset(skip).limit(limit).all() 
\ No newline at end of file
@@ -18,11 +18,16 @@ if not SQLALCHEMY_DATABASE_URL:
     logger.error("DATABASE_URL environment variable is not set")
     raise ValueError("DATABASE_URL environment variable is not set")
 
+# Size the pool for the endpoint threadpool; the default 5 connections lock
+# up under bursts of concurrent requests
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+
 # Configure engine for PostgreSQL
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
-    pool_size=5,
-    max_overflow=10,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
     pool_timeout=30,
     pool_recycle=1800,
     pool_pre_ping=True,  # Enable connection health checks
@@ -38,6 +43,10 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+def get_session_factory():
+    """Dependency returning the factory for sessions opened outside a request, e.g. in background tasks"""
+    return SessionLocal
+
 def get_db():
     db = SessionLocal()
     try:
@@ -3,13 +3,13 @@ import mimetypes
 import logging
 from fastapi import UploadFile
 from datetime import datetime
-from .utils.s3_service import S3Service
+from .utils.s3_service import get_s3_service
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
 # Initialize S3 service
-s3_service = S3Service()
+s3_service = get_s3_service()
 
 # Allowed file types
 ALLOWED_TYPES = {
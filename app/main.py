@@ -1,18 +1,23 @@
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form, Request, Query, Response
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form, Request, Query, Response, BackgroundTasks
 from fastapi.security import OAuth2PasswordRequestForm
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import JSONResponse, RedirectResponse, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session, joinedload
+from fastapi.middleware.gzip import GZipMiddleware
+from anyio import to_thread
+from sqlalchemy.orm import Session, joinedload, selectinload, raiseload
 from typing import List, Optional
 import os
 import logging
+import time
 from datetime import timedelta, datetime
 from pydantic import BaseModel
 import shutil
+import tempfile
 from . import models, schemas, crud
-from .database import engine, get_db
+from .database import engine, get_db, get_session_factory
 from .utils import versioning
-from .utils.s3_service import S3Service
+from .utils.s3_service import get_s3_service
+from .utils.cache import cache_get, cache_set
 from .auth.auth import (
     get_password_hash,
     verify_password,
@@ -20,6 +25,7 @@ from .auth.auth import (
     get_current_user,
     get_current_active_user,
     get_current_admin_user,
+    invalidate_cached_user,
     ACCESS_TOKEN_EXPIRE_MINUTES,
     authenticate_user
 )
@@ -28,7 +34,7 @@ from passlib.context import CryptContext
 from dotenv import load_dotenv
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
-from sqlalchemy import text  # Add this import at the top with other imports
+from sqlalchemy import text, update, or_, inspect  # Add this import at the top with other imports
 import io
 from fastapi.responses import StreamingResponse
 
@@ -42,10 +48,29 @@ logger = logging.getLogger(__name__)
 # Create database tables
 models.Base.metadata.create_all(bind=engine)
 
+# Maximum levels of nested children returned for a folder listing
+MAX_TREE_DEPTH = 3
+
+# Text files larger than this are previewed through a presigned URL instead of inline
+PREVIEW_MAX_BYTES = 2 * 1024 * 1024
+
+# Preview URLs are valid for an hour and reused from the cache for up to half of that,
+# never past a minute before the URL expires
+PREVIEW_URL_EXPIRES_SECONDS = 3600
+PREVIEW_URL_CACHE_SECONDS = 1800
+PREVIEW_URL_EXPIRY_MARGIN_SECONDS = 60
+
+# Extensions previewed as text by get_file_content
+CODE_EXTENSIONS = frozenset({
+    '.py', '.js', '.ts', '.tsx', '.jsx', '.java', '.cpp', '.c', '.h', '.hpp', '.cs', '.rb', '.go', '.rs',
+    '.swift', '.php', '.sh', '.pl', '.lua', '.md', '.json', '.yml', '.yaml', '.toml', '.ini', '.txt'
+})
+
 # Initialize S3 service
-s3_service = S3Service()
+s3_service = get_s3_service()
 
-app = FastAPI(title="MyDrive")
+# Serialize responses with orjson; hot list routes also skip response_model validation
+app = FastAPI(title="MyDrive", default_response_class=ORJSONResponse)
 
 # Configure CORS
 app.add_middleware(
@@ -64,20 +89,34 @@ app.add_middleware(
     max_age=3600,
 )
 
+# Compress JSON responses; listings repeat the same keys for every file
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
+@app.on_event("startup")
+def configure_threadpool():
+    # Sync endpoints run in anyio's worker threadpool (40 threads by default);
+    # raise the limit so blocking S3/DB calls don't queue behind each other
+    to_thread.current_default_thread_limiter().total_tokens = int(os.getenv("THREADPOOL_SIZE", "200"))
+
 # Mount static files
 static_dir = Path("static")
 static_dir.mkdir(exist_ok=True)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+# Paths that are too frequent and uninteresting to log
+UNLOGGED_PATHS = frozenset(("/", "/health"))
+
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    logger.info(f"Request: {request.method} {request.url}")
+    path = request.url.path
+    if path not in UNLOGGED_PATHS and not path.startswith("/static/") and logger.isEnabledFor(logging.INFO):
+        logger.info("Request: %s %s", request.method, path)
     response = await call_next(request)
     return response
 
 # Authentication routes
 @app.post("/token", response_model=schemas.Token)
-async def login_for_access_token(
+def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: Session = Depends(get_db)
 ):
@@ -94,7 +133,7 @@ async def login_for_access_token(
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.post("/register", response_model=schemas.User)
-async def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     try:
         logger.info(f"Registration attempt for user: {user.username}")
         
@@ -140,8 +179,10 @@ async def register_user(user: schemas.UserCreate, db: Session = Depends(get_db))
         logger.error(f"Unexpected error during registration: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-# Recursive helper function to convert SQLAlchemy File model to dictionary
-def file_to_dict(file_obj: models.File):
+# Recursive helper function to convert SQLAlchemy File model to dictionary.
+# Children are included down to `depth` levels, and only if they were eager-loaded,
+# so converting a listing never triggers lazy loads.
+def file_to_dict(file_obj: models.File, depth: int = 0):
     if file_obj is None:
         return None
         
@@ -174,57 +215,132 @@ def file_to_dict(file_obj: models.File):
         file_dict["version"] = file_obj.version
     if hasattr(file_obj, 'mime_type'):
         file_dict["mime_type"] = file_obj.mime_type
+    if getattr(file_obj, 'status', None):
+        file_dict["status"] = file_obj.status
     
-    # Recursively convert children if they exist
+    # Recursively convert children if they were loaded
     children_list = []
-    # Check if children relationship is loaded and is an iterable
-    if hasattr(file_obj, 'children') and isinstance(file_obj.children, (list, tuple)):
+    if depth > 0 and isinstance(file_obj, models.File) and 'children' not in inspect(file_obj).unloaded:
         for child_item in file_obj.children:
-            children_list.append(file_to_dict(child_item))
+            children_list.append(file_to_dict(child_item, depth - 1))
     # Ensure children key is always a list
     file_dict["children"] = children_list
     
     return file_dict
 
-# File operations
-@app.post("/files/upload", response_model=schemas.File, status_code=status.HTTP_201_CREATED)
-async def upload_file(
-    file: UploadFile = File(...),
+def get_owned_folder(db: Session, folder_id: int, owner_id: int) -> int:
+    """Check that a folder is owned by the given user and return its id, or raise 404"""
+    # Only the id is selected; callers just need to know the folder exists
+    folder = db.query(models.File.id).filter(
+        models.File.id == folder_id,
+        models.File.owner_id == owner_id,
+        models.File.type == 'folder'
+    ).first()
+    if not folder:
+        logger.error(f"Parent folder not found or not owned by user: {folder_id}")
+        raise HTTPException(status_code=404, detail="Parent folder not found or not owned by user")
+    return folder.id
+
+def get_owned_parent_id(
     parent_id: Optional[int] = Form(None),
     current_user: models.User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
+) -> Optional[int]:
+    """Dependency checking that the optional parent_id form field is a folder owned by the current user"""
+    if parent_id is None:
+        return None
+    return get_owned_folder(db, parent_id, current_user.id)
+
+def get_owned_file(
+    file_id: int,
+    current_user: models.User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+) -> models.File:
+    """Dependency resolving the file_id path parameter to an item owned by the current user"""
+    item = db.query(models.File).filter(models.File.id == file_id).first()
+    if not item:
+        raise HTTPException(status_code=404, detail="File or folder not found")
+    if item.owner_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Not authorized to modify this item")
+    return item
+
+def get_owned_file_access(
+    file_id: int,
+    current_user: models.User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """Like get_owned_file, but resolves to crud.get_file_access's narrow row for
+    endpoints that only read the item"""
+    item = crud.get_file_access(db, file_id)
+    if not item:
+        raise HTTPException(status_code=404, detail="File or folder not found")
+    if item.owner_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Not authorized to modify this item")
+    return item
+
+def upload_and_finalize(session_factory, file_id: int, tmp_path: str, filename: str, user_id: int):
+    """Upload a staged file to S3 and mark its record as ready (runs as a background task)"""
+    db = session_factory()
+    try:
+        with open(tmp_path, 'rb') as staged:
+            s3_key = s3_service.upload_file(staged, filename, str(user_id))
+        logger.info(f"File uploaded to S3 with key: {s3_key}")
+        db.query(models.File).filter(models.File.id == file_id).update({"status": "ready"})
+        db.commit()
+    except Exception as e:
+        logger.error(f"Error uploading file {file_id} to S3: {str(e)}")
+        db.rollback()
+        try:
+            db.query(models.File).filter(models.File.id == file_id).update({"status": "failed"})
+            db.commit()
+        except Exception as e:
+            # Nothing else can record the failure, so log it rather than letting it escape the task
+            logger.error(f"Error marking file {file_id} as failed: {str(e)}")
+            db.rollback()
+    finally:
+        db.close()
+        try:
+            os.remove(tmp_path)
+        except OSError as e:
+            logger.error(f"Error removing staged upload {tmp_path}: {str(e)}")
+
+def require_ready(file) -> None:
+    """Raise 409 unless the file's upload to S3 has finished"""
+    if file.status != 'ready':
+        raise HTTPException(status_code=409, detail=f"File is not ready (status: {file.status})")
+
+# File operations
+@app.post("/files/upload", response_model=schemas.File, status_code=status.HTTP_202_ACCEPTED)
+def upload_file(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    parent_id: Optional[int] = Depends(get_owned_parent_id),
+    current_user: models.User = Depends(get_current_active_user),
+    db: Session = Depends(get_db),
+    session_factory = Depends(get_session_factory)
 ):
+    """Accept an upload and push it to S3 in the background.
+
+    Responds 202 with the file record in status 'uploading'. The status
+    switches to 'ready' (or 'failed') once the S3 upload finishes; poll
+    GET /files/{file_id} for it. Content and download requests get 409
+    until the file is ready.
+    """
+    tmp_path = None
     try:
         logger.info(f"Starting file upload for user {current_user.username}")
         logger.info(f"File details: filename={file.filename}, content_type={file.content_type}")
-        
-        if parent_id is not None:
-            logger.info(f"Checking parent folder with ID: {parent_id}")
-            parent_folder = db.query(models.File).filter(
-                models.File.id == parent_id,
-                models.File.owner_id == current_user.id,
-                models.File.type == 'folder'
-            ).first()
-            if not parent_folder:
-                logger.error(f"Parent folder not found or not owned by user: {parent_id}")
-                raise HTTPException(status_code=404, detail="Parent folder not found or not owned by user")
 
-        # Get file size before uploading
-        file.file.seek(0, 2)  # Seek to end
-        file_size = file.file.tell()
-        file.file.seek(0)  # Reset to beginning
+        # Stage the upload on local disk; the request's temp file is closed
+        # once the response is sent, before the background task runs
+        with tempfile.NamedTemporaryFile(delete=False) as staged:
+            shutil.copyfileobj(file.file, staged)
+            file_size = staged.tell()
+            tmp_path = staged.name
 
         # Get file type
         file_type = file.content_type or 'application/octet-stream'
-        
-        # Upload file to S3
-        logger.info("Uploading file to S3...")
-        try:
-            s3_key = s3_service.upload_file(file.file, file.filename, str(current_user.id))
-            logger.info(f"File uploaded to S3 with key: {s3_key}")
-        except Exception as e:
-            logger.error(f"Error uploading to S3: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Error uploading file to S3: {str(e)}")
+        s3_key = s3_service.get_upload_key(file.filename, str(current_user.id))
         
         logger.info("Creating database record...")
         try:
@@ -237,7 +353,8 @@ async def upload_file(
                 owner_id=current_user.id,
                 parent_id=parent_id,
                 type='file',
-                mime_type=file_type
+                mime_type=file_type,
+                status='uploading'
             )
             db.add(db_file)
             db.commit()
@@ -245,14 +362,9 @@ async def upload_file(
             logger.info(f"Database record created with ID: {db_file.id}")
         except Exception as e:
             logger.error(f"Error creating database record: {str(e)}")
-            # Try to clean up the S3 file if database operation fails
-            try:
-                s3_service.delete_file(s3_key)
-            except Exception as cleanup_error:
-                logger.error(f"Error cleaning up S3 file after database failure: {str(cleanup_error)}")
             raise HTTPException(status_code=500, detail=f"Error creating file record: {str(e)}")
 
-        # After successful upload, create initial version using raw SQL
+        # After the record is created, create initial version using raw SQL
         if db_file.type == 'file':
             logger.info("Creating initial version...")
             try:
@@ -276,9 +388,13 @@ async def upload_file(
                 logger.error(f"Error creating version: {str(e)}")
                 # Continue even if version creation fails
 
+        # Upload file to S3 after the response has been sent
+        background_tasks.add_task(upload_and_finalize, session_factory, db_file.id, tmp_path, file.filename, current_user.id)
+        tmp_path = None
+
         # Convert the newly created SQLAlchemy file object to a dictionary
         result = file_to_dict(db_file)
-        logger.info("File upload completed successfully")
+        logger.info("File upload accepted")
         return result
         
     except HTTPException as he:
@@ -287,6 +403,10 @@ async def upload_file(
     except Exception as e:
         logger.error(f"Unexpected error during file upload: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Unexpected error during file upload: {str(e)}")
+    finally:
+        # Remove the staged file unless the background task took ownership of it
+        if tmp_path:
+            os.remove(tmp_path)
 
 def get_folder_contents(db: Session, folder_id: int, current_user_id: int):
     """Get all files in a folder that are shared with the user."""
@@ -323,7 +443,12 @@ def get_folder_contents(db: Session, folder_id: int, current_user_id: int):
     
     return contents
 
-@app.get("/files/shared-with-me", response_model=List[schemas.FileShare])
+def file_share_list_response(shares) -> ORJSONResponse:
+    """Serialize FileShare rows with the prebuilt list adapter"""
+    adapter = schemas.FILE_SHARE_LIST_ADAPTER
+    return ORJSONResponse(adapter.dump_python(adapter.validate_python(shares), mode='json'))
+
+@app.get("/files/shared-with-me", response_model=None)
 def files_shared_with_me(
     current_user: models.User = Depends(get_current_active_user),
     skip: int = 0,
@@ -334,17 +459,18 @@ def files_shared_with_me(
     logger.info(f"Fetching shared files for user: {current_user.email} (ID: {current_user.id})")
     try:
         # First try with share_date
-        return db.query(models.FileShare).filter(
+        shares = db.query(models.FileShare).filter(
             models.FileShare.shared_with_id == current_user.id
         ).order_by(models.FileShare.share_date.desc()).offset(skip).limit(limit).all()
     except Exception as e:
         logger.error(f"Error fetching shared files: {str(e)}")
         # If share_date column doesn't exist, try without it
-        return db.query(models.FileShare).filter(
+        shares = db.query(models.FileShare).filter(
             models.FileShare.shared_with_id == current_user.id
         ).offset(skip).limit(limit).all()
+    return file_share_list_response(shares)
 
-@app.get("/files/recent-shared", response_model=List[schemas.FileShare])
+@app.get("/files/recent-shared", response_model=None)
 def recent_shared_files(
     current_user: models.User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
@@ -353,32 +479,34 @@ def recent_shared_files(
     logger.info(f"Fetching recent shared files for user: {current_user.email}")
     try:
         # First try with share_date
-        return db.query(models.FileShare).filter(
+        shares = db.query(models.FileShare).filter(
             models.FileShare.shared_with_id == current_user.id,
             models.FileShare.file_id.isnot(None)
         ).order_by(models.FileShare.share_date.desc()).limit(3).all()
     except Exception as e:
         logger.error(f"Error fetching recent shared files: {str(e)}")
         # If share_date column doesn't exist, try without it
-        return db.query(models.FileShare).filter(
+        shares = db.query(models.FileShare).filter(
             models.FileShare.shared_with_id == current_user.id,
             models.FileShare.file_id.isnot(None)
         ).limit(3).all()
+    return file_share_list_response(shares)
 
-@app.get("/files/", response_model=List[schemas.File])
+@app.get("/files/", response_model=None)
 def get_files(
     parent_id: Optional[int] = None,
     current_user: models.User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
-    query = db.query(models.File).filter(models.File.owner_id == current_user.id)
+    # file_to_dict only reads columns at depth 0, so relationships raise rather than lazy-load per row
+    query = db.query(models.File).options(raiseload("*")).filter(models.File.owner_id == current_user.id)
     if parent_id is not None:
         query = query.filter(models.File.parent_id == parent_id)
     else:
         query = query.filter(models.File.parent_id.is_(None))
     files = [file_to_dict(file) for file in query.all()]
-    logger.info(f"Returning files: {files}")
-    return files
+    logger.info(f"Returning {len(files)} files")
+    return ORJSONResponse(files)
 
 @app.get("/files/all", response_model=List[schemas.File])
 def get_all_files(
@@ -423,34 +551,20 @@ def get_file(
     if file.owner_id != current_user.id and not file.is_shared:
         raise HTTPException(status_code=403, detail="Not authorized to access this file")
     
-    # For folders, we don't need to check the file path, return the dictionary representation
-    if file.type == 'folder':
-        return file_to_dict(file)
-    
-    # For files, verify the file exists
-    if not file.file_path or not os.path.exists(file.file_path):
-        raise HTTPException(status_code=404, detail="File not found on server")
-    
-    return file
+    # File bytes live in S3 and are fetched through /content or /download,
+    # so only the metadata is returned here
+    return file_to_dict(file)
 
 @app.delete("/files/{file_id}")
 def delete_file(
     file_id: int,
+    file = Depends(get_owned_file_access),
     current_user: models.User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
     try:
         logger.info(f"Delete request for file ID: {file_id} from user: {current_user.username}")
         
-        # Get the file
-        file = db.query(models.File).filter(models.File.id == file_id).first()
-        if not file:
-            raise HTTPException(status_code=404, detail="File not found")
-        
-        # Check if user is the owner
-        if file.owner_id != current_user.id:
-            raise HTTPException(status_code=403, detail="Not authorized to delete this file")
-        
         # Delete the file from S3 if it's a file (not a folder)
         if file.type == 'file' and file.file_path:
             try:
@@ -514,21 +628,20 @@ def recursively_share_folder(db: Session, folder_id: int, shared_with_id: int, p
     children = db.query(models.File).filter(models.File.parent_id == folder_id).all()
     logger.info(f"Found {len(children)} items in folder {folder_id}")
     
+    file_ids = []
     for child in children:
         # Only create share entry for files, not folders
         if child.type == 'file':
             logger.info(f"Sharing file: {child.filename} (ID: {child.id})")
-            # Create share entry for this file
-            share = models.FileShare(
-                file_id=child.id,
-                shared_with_id=shared_with_id,
-                permission=permission
-            )
-            db.add(share)
-            child.is_shared = True
+            file_ids.append(child.id)
         else:
             logger.info(f"Skipping subfolder: {child.filename} (ID: {child.id})")
     
+    # Create or update the share entries for all files in one statement
+    crud.upsert_file_shares(db, file_ids, shared_with_id, permission)
+    # Flag the shared files with a single UPDATE instead of one per dirty ORM object
+    mark_shared = text("UPDATE files SET is_shared = TRUE WHERE parent_id = :folder_id AND type = 'file'")
+    db.execute(mark_shared, {"folder_id": folder_id})
     db.commit()
     logger.info(f"Finished sharing contents of folder {folder_id}")
 
@@ -536,45 +649,19 @@ def recursively_share_folder(db: Session, folder_id: int, shared_with_id: int, p
 def share_file(
     file_id: int,
     share_data: schemas.FileShareCreate,
+    item = Depends(get_owned_file_access),
     current_user: models.User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
     try:
         logger.info(f"Share request for file/folder ID: {file_id} from user: {current_user.username}")
-        # Get the file/folder to share
-        item = db.query(models.File).filter(models.File.id == file_id).first()
-        if not item:
-            raise HTTPException(status_code=404, detail="File or folder not found")
         logger.info(f"Found item: {item.filename} (ID: {item.id}, type: {item.type})")
-        # Check if user is the owner
-        if item.owner_id != current_user.id:
-            raise HTTPException(status_code=403, detail="Not authorized to share this item")
         # Get the user to share with by email
         shared_with_user = db.query(models.User).filter(models.User.email == share_data.shared_with_email).first()
         if not shared_with_user:
             raise HTTPException(status_code=404, detail="User not found")
-        # Check if already shared
-        existing_share = db.query(models.FileShare).filter(
-            models.FileShare.file_id == file_id,
-            models.FileShare.shared_with_id == shared_with_user.id
-        ).first()
-        if existing_share:
-            # Update existing share
-            existing_share.permission = share_data.permission
-            db.commit()
-            logger.info(f"Updated share for {item.filename} with user {shared_with_user.email}")
-            return {
-                "file_id": file_id,
-                "shared_with": shared_with_user.email,
-                "permission": share_data.permission
-            }
-        # Create new share
-        share = models.FileShare(
-            file_id=file_id,
-            shared_with_id=shared_with_user.id,
-            permission=share_data.permission
-        )
-        db.add(share)
+        # Create the share, or update its permission if it already exists
+        crud.upsert_file_shares(db, [file_id], shared_with_user.id, share_data.permission)
         # If it's a folder, recursively share all contents
         if item.type == 'folder':
             recursively_share_folder(db, file_id, shared_with_user.id, share_data.permission)
@@ -602,13 +689,7 @@ def create_folder(
         
         # Check if parent folder exists and is owned by user
         if folder_data.parent_id is not None:
-            parent_folder = db.query(models.File).filter(
-                models.File.id == folder_data.parent_id,
-                models.File.owner_id == current_user.id,
-                models.File.type == 'folder'
-            ).first()
-            if not parent_folder:
-                raise HTTPException(status_code=404, detail="Parent folder not found or not owned by user")
+            get_owned_folder(db, folder_data.parent_id, current_user.id)
 
         # Create folder record with explicit type='folder'
         db_folder = models.File(
@@ -639,11 +720,12 @@ def create_folder(
 @app.get("/files/{folder_id}/contents", response_model=List[schemas.File])
 def get_folder_contents_endpoint(
     folder_id: int,
+    depth: int = Query(0, ge=0, le=MAX_TREE_DEPTH, description="Levels of nested children to include"),
     current_user: models.User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
     # First check if the folder exists and user has access
-    folder = db.query(models.File).filter(
+    folder = db.query(models.File.owner_id).filter(
         models.File.id == folder_id,
         models.File.type == 'folder'
     ).first()
@@ -654,39 +736,38 @@ def get_folder_contents_endpoint(
     # Check if user has access to the folder
     if folder.owner_id != current_user.id:
         # Check if folder is shared with user
-        share = db.query(models.FileShare).filter(
+        share = db.query(models.FileShare.id).filter(
             models.FileShare.file_id == folder_id,
             models.FileShare.shared_with_id == current_user.id
         ).first()
         if not share:
             raise HTTPException(status_code=403, detail="Not authorized to access this folder")
     
-    # Get all files and subfolders in the folder
-    contents = db.query(models.File).filter(
-        models.File.parent_id == folder_id
-    ).all()
+    # Get all files and subfolders in the folder, eager-loading one query per nested level
+    query = db.query(models.File).filter(models.File.parent_id == folder_id)
+    if depth > 0:
+        loader = selectinload(models.File.children)
+        for _ in range(depth - 1):
+            loader = loader.selectinload(models.File.children)
+        query = query.options(loader)
+    contents = query.all()
     
-    return [file_to_dict(item) for item in contents]
+    return [file_to_dict(item, depth) for item in contents]
 
 @app.get("/users/me", response_model=schemas.User)
 def read_users_me(current_user: models.User = Depends(get_current_active_user)):
     """Get current user profile with username"""
     try:
-        # Ensure we have the latest data
-        db = next(get_db())
-        user = db.query(models.User).filter(models.User.id == current_user.id).first()
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        # Return user data with all required fields
+        # current_user was loaded by get_current_user in this request's session,
+        # so there is no need to query the database again
         return {
-            "id": user.id,
-            "email": user.email,
-            "username": user.username,
-            "is_active": user.is_active,
-            "is_admin": user.is_admin,
-            "created_at": user.created_at if hasattr(user, 'created_at') else datetime.utcnow(),
-            "updated_at": user.updated_at if hasattr(user, 'updated_at') else datetime.utcnow()
+            "id": current_user.id,
+            "email": current_user.email,
+            "username": current_user.username,
+            "is_active": current_user.is_active,
+            "is_admin": current_user.is_admin,
+            "created_at": current_user.created_at if hasattr(current_user, 'created_at') else datetime.utcnow(),
+            "updated_at": current_user.updated_at if hasattr(current_user, 'updated_at') else datetime.utcnow()
         }
     except Exception as e:
         logger.error(f"Error getting user profile: {str(e)}")
@@ -722,58 +803,7 @@ def create_file(
 ):
     return crud.create_file(db=db, file=file, user_id=current_user.id)
 
-@app.get("/files/", response_model=list[schemas.File])
-def read_files(
-    skip: int = 0,
-    limit: int = 100,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
-):
-    files = crud.get_user_files(db, user_id=current_user.id, skip=skip, limit=limit)
-    return files
-
-@app.get("/files/{file_id}", response_model=schemas.File)
-def read_file(
-    file_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
-):
-    db_file = crud.get_file(db, file_id=file_id)
-    if db_file is None:
-        raise HTTPException(status_code=404, detail="File not found")
-    if db_file.owner_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Not authorized to access this file")
-    return db_file
-
-@app.delete("/files/{file_id}")
-def delete_file(
-    file_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
-):
-    db_file = crud.get_file(db, file_id=file_id)
-    if db_file is None:
-        raise HTTPException(status_code=404, detail="File not found")
-    if db_file.owner_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Not authorized to delete this file")
-    crud.delete_file(db=db, file_id=file_id)
-    return {"message": "File deleted successfully"}
-
-@app.post("/files/{file_id}/share", response_model=schemas.FileShare)
-def share_file(
-    file_id: int,
-    share: schemas.FileShareCreate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
-):
-    db_file = crud.get_file(db, file_id=file_id)
-    if db_file is None:
-        raise HTTPException(status_code=404, detail="File not found")
-    if db_file.owner_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Not authorized to share this file")
-    return crud.create_file_share(db=db, file_id=file_id, share=share)
-
-@app.get("/shared-files/", response_model=list[schemas.File])
+@app.get("/shared-files/", response_model=None)
 def read_shared_files(
     skip: int = 0,
     limit: int = 100,
@@ -781,7 +811,7 @@ def read_shared_files(
     current_user: models.User = Depends(get_current_user)
 ):
     files = crud.get_shared_files(db, user_id=current_user.id, skip=skip, limit=limit)
-    return files
+    return ORJSONResponse([file_to_dict(file) for file in files])
 
 @app.post("/files/{file_id}/versions", response_model=schemas.FileVersion)
 def create_file_version(
@@ -790,14 +820,15 @@ def create_file_version(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    db_file = crud.get_file(db, file_id=file_id)
+    db_file = crud.get_file_access(db, file_id)
     if db_file is None:
         raise HTTPException(status_code=404, detail="File not found")
     if db_file.owner_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized to create version for this file")
+    require_ready(db_file)
     return crud.create_file_version(db=db, file_id=file_id, version=version, user_id=current_user.id)
 
-@app.get("/files/{file_id}/versions", response_model=list[schemas.FileVersion])
+@app.get("/files/{file_id}/versions", response_model=None)
 def read_file_versions(
     file_id: int,
     skip: int = 0,
@@ -805,13 +836,31 @@ def read_file_versions(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    db_file = crud.get_file(db, file_id=file_id)
+    db_file = crud.get_file_access(db, file_id)
     if db_file is None:
         raise HTTPException(status_code=404, detail="File not found")
     if db_file.owner_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized to view versions of this file")
     versions = crud.get_file_versions(db, file_id=file_id, skip=skip, limit=limit)
-    return versions
+    return ORJSONResponse([version._asdict() for version in versions])
+
+def check_user_conflicts(db: Session, user_id: int, email: Optional[str], username: Optional[str]):
+    """Raise 400 if another user already has the email or username, checking both in one query"""
+    conditions = []
+    if email:
+        conditions.append(models.User.email == email)
+    if username:
+        conditions.append(models.User.username == username)
+    if not conditions:
+        return
+    conflict = db.query(models.User.email, models.User.username).filter(
+        or_(*conditions),
+        models.User.id != user_id
+    ).first()
+    if conflict:
+        if email and conflict.email == email:
+            raise HTTPException(status_code=400, detail="Email already registered")
+        raise HTTPException(status_code=400, detail="Username already taken")
 
 @app.patch("/users/me", response_model=schemas.User)
 def update_user_profile(
@@ -820,27 +869,22 @@ def update_user_profile(
     db: Session = Depends(get_db)
 ):
     try:
-        # Check if email is being updated and if it's already taken
-        if user_update.email and user_update.email != current_user.email:
-            existing_user = db.query(models.User).filter(models.User.email == user_update.email).first()
-            if existing_user:
-                raise HTTPException(status_code=400, detail="Email already registered")
-
-        # Check if username is being updated and if it's already taken
-        if user_update.username and user_update.username != current_user.username:
-            existing_user = db.query(models.User).filter(models.User.username == user_update.username).first()
-            if existing_user:
-                raise HTTPException(status_code=400, detail="Username already taken")
+        # Check if the new email or username is already taken by someone else
+        check_user_conflicts(db, current_user.id, user_update.email, user_update.username)
+
+        # current_user may come from the auth cache, so update the row loaded in this session
+        user = db.query(models.User).filter(models.User.id == current_user.id).first()
 
         # Update user fields
         if user_update.email:
-            current_user.email = user_update.email
+            user.email = user_update.email
         if user_update.username:
-            current_user.username = user_update.username
+            user.username = user_update.username
 
         db.commit()
-        db.refresh(current_user)
-        return current_user
+        db.refresh(user)
+        invalidate_cached_user(user.id)
+        return user
     except HTTPException as he:
         raise he
     except Exception as e:
@@ -848,15 +892,15 @@ def update_user_profile(
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/files/{file_id}/content")
-async def get_file_content(
+def get_file_content(
     file_id: int,
     current_user: models.User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
     """Get file content or presigned URL from S3"""
     try:
-        # Get file from database
-        file = db.query(models.File).filter(models.File.id == file_id).first()
+        # Get the columns needed to authorize and serve the file
+        file = crud.get_file_access(db, file_id)
         if not file:
             raise HTTPException(status_code=404, detail="File not found")
         # Check if user has access
@@ -865,22 +909,24 @@ async def get_file_content(
         # Prevent preview for folders
         if file.type == 'folder' or (file.mime_type == 'folder'):
             raise HTTPException(status_code=400, detail="Cannot preview a folder")
+        require_ready(file)
         # If file is text or code, return content
-        code_extensions = ['.py', '.js', '.ts', '.tsx', '.jsx', '.java', '.cpp', '.c', '.h', '.hpp', '.cs', '.rb', '.go', '.rs', '.swift', '.php', '.sh', '.pl', '.lua', '.md', '.json', '.yml', '.yaml', '.toml', '.ini', '.txt']
-        ext = os.path.splitext(file.filename)[1].lower()
-        is_code = ext in code_extensions
+        dot = file.filename.rfind('.')
+        ext = file.filename[dot:].lower() if dot >= 0 else ''
+        is_code = ext in CODE_EXTENSIONS
         is_text = (file.file_type and file.file_type.startswith('text/')) or (file.mime_type and file.mime_type.startswith('text/'))
-        if is_text or is_code:
+        # Large text files fall through to the presigned URL so they aren't pulled into memory
+        if (is_text or is_code) and (file.file_size or 0) <= PREVIEW_MAX_BYTES:
             try:
-                file_content = s3_service.get_file(file.file_path)
+                # Cap the read in case the recorded size is stale
+                file_content = s3_service.get_file(file.file_path, max_bytes=PREVIEW_MAX_BYTES)
                 return {"content": file_content.decode('utf-8', errors='replace')}
             except Exception as e:
                 logger.error(f"Error getting text/code file from S3: {str(e)}")
                 raise HTTPException(status_code=500, detail="Error retrieving file")
         # For binary files (pdf, images, etc.), return a presigned URL
         try:
-            url = s3_service.get_file_url(file.file_path)
-            return {"url": url}
+            return {"url": get_preview_url(file.id, file.file_path)}
         except Exception as e:
             logger.error(f"Error generating presigned URL: {str(e)}")
             raise HTTPException(status_code=500, detail="Error retrieving file URL")
@@ -890,16 +936,34 @@ async def get_file_content(
         logger.error(f"Error getting file content: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def get_preview_url(file_id: int, file_path: str) -> str:
+    """Get an inline presigned URL for a file, reusing a cached one while it is still fresh.
+
+    The cache key includes the S3 key, so pointing the file at a new version
+    naturally misses the old entry.
+    """
+    key = f"presigned_url:{file_id}:{file_path}"
+    cached = cache_get(key)
+    if cached:
+        return cached["url"]
+    # The S3 service may hand back a URL it signed earlier, so cache it only for what's left of its lifetime
+    url, expires_at = s3_service.get_file_url_with_expiry(file_path, expires_in=PREVIEW_URL_EXPIRES_SECONDS)
+    ttl = min(PREVIEW_URL_CACHE_SECONDS, int(expires_at - time.time()) - PREVIEW_URL_EXPIRY_MARGIN_SECONDS)
+    if ttl > 0:
+        cache_set(key, {"url": url}, ttl)
+    return url
+
 @app.get("/files/{file_id}/download")
-async def download_file(
+def download_file(
     file_id: int,
+    stream: bool = Query(False, description="Proxy the bytes through the API instead of redirecting to S3"),
     current_user: models.User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
-    """Download a file from S3"""
+    """Download a file by redirecting to a presigned S3 URL, or by streaming it when requested"""
     try:
-        # Get file from database
-        file = db.query(models.File).filter(models.File.id == file_id).first()
+        # Get the columns needed to authorize and serve the file
+        file = crud.get_file_access(db, file_id)
         if not file:
             raise HTTPException(status_code=404, detail="File not found")
         
@@ -910,19 +974,37 @@ async def download_file(
         # Prevent download for folders
         if file.type == 'folder' or (file.mime_type == 'folder'):
             raise HTTPException(status_code=400, detail="Cannot download a folder")
+        require_ready(file)
         
+        if stream:
+            try:
+                # Relay the S3 body chunk by chunk so memory stays bounded by the chunk size
+                return StreamingResponse(
+                    s3_service.get_file_stream(file.file_path),
+                    media_type=file.file_type or 'application/octet-stream',
+                    headers={
+                        'Content-Disposition': f'attachment; filename="{file.filename}"',
+                        # Stored file bytes are passed through as-is, skip gzip
+                        'Content-Encoding': 'identity'
+                    }
+                )
+            except Exception as e:
+                logger.error(f"Error getting file from S3: {str(e)}")
+                raise HTTPException(status_code=500, detail="Error retrieving file")
+
         try:
-            # Get file from S3
-            file_content = s3_service.get_file(file.file_path)
-            return StreamingResponse(
-                io.BytesIO(file_content),
-                media_type=file.file_type or 'application/octet-stream',
-                headers={
-                    'Content-Disposition': f'attachment; filename="{file.filename}"'
-                }
+            # Redirect to a short-lived presigned URL so the bytes go straight
+            # from S3 to the client instead of through this process
+            url = s3_service.get_file_url(
+                file.file_path,
+                expires_in=300,
+                disposition='attachment',
+                filename=file.filename,
+                content_type=file.file_type
             )
+            return RedirectResponse(url, status_code=status.HTTP_307_TEMPORARY_REDIRECT)
         except Exception as e:
-            logger.error(f"Error getting file from S3: {str(e)}")
+            logger.error(f"Error generating presigned URL: {str(e)}")
             raise HTTPException(status_code=500, detail="Error retrieving file")
     except HTTPException as he:
         raise he
@@ -931,39 +1013,40 @@ async def download_file(
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.patch("/files/{file_id}/move")
-async def move_file(
+def move_file(
     file_id: int,
     move_data: schemas.FileMove,
-    current_user: models.User = Depends(get_current_active_user),
+    item: models.File = Depends(get_owned_file),
     db: Session = Depends(get_db)
 ):
     """Move a file or folder to a different parent folder"""
     try:
-        # Get the file/folder to move
-        item = db.query(models.File).filter(models.File.id == file_id).first()
-        if not item:
-            raise HTTPException(status_code=404, detail="File or folder not found")
-        
-        # Check if user is the owner
-        if item.owner_id != current_user.id:
-            raise HTTPException(status_code=403, detail="Not authorized to move this item")
-        
         # If moving to a folder, verify it exists and user has access
         if move_data.target_parent_id is not None:
-            target_folder = db.query(models.File).filter(
+            target_folder = db.query(models.File.id).filter(
                 models.File.id == move_data.target_parent_id,
                 models.File.type == 'folder'
             ).first()
             if not target_folder:
                 raise HTTPException(status_code=404, detail="Target folder not found")
             
-            # Prevent moving a folder into itself or its descendants
+            # Prevent moving a folder into itself or its descendants, i.e. the
+            # item must not be the target or one of the target's ancestors
             if item.type == 'folder':
-                current = target_folder
-                while current is not None:
-                    if current.id == item.id:
-                        raise HTTPException(status_code=400, detail="Cannot move a folder into itself or its descendants")
-                    current = current.parent
+                find_ancestor = text("""
+                    WITH RECURSIVE ancestors AS (
+                        SELECT id, parent_id FROM files WHERE id = :target_id
+                        UNION ALL
+                        SELECT f.id, f.parent_id FROM files f JOIN ancestors a ON f.id = a.parent_id
+                    )
+                    SELECT 1 FROM ancestors WHERE id = :item_id LIMIT 1
+                """)
+                is_cycle = db.execute(find_ancestor, {
+                    "target_id": move_data.target_parent_id,
+                    "item_id": item.id
+                }).first()
+                if is_cycle:
+                    raise HTTPException(status_code=400, detail="Cannot move a folder into itself or its descendants")
         
         # Update the parent_id
         item.parent_id = move_data.target_parent_id
@@ -978,15 +1061,36 @@ async def move_file(
         raise HTTPException(status_code=500, detail=str(e))
 
 # Admin routes
-@app.get("/admin/users", response_model=List[schemas.User])
+@app.get("/admin/users", response_model=None)
 def get_all_users(
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[int] = None,
     current_user: models.User = Depends(get_current_admin_user),
     db: Session = Depends(get_db)
 ):
-    """Get all users (admin only)"""
+    """
+    Get a page of users (admin only), ordered by id.
+    
+    Pass next_cursor from a page as cursor to get the next one; it is null on the last page.
+    """
     try:
-        users = db.query(models.User).all()
-        return users
+        query = db.query(
+            models.User.id,
+            models.User.email,
+            models.User.username,
+            models.User.is_active,
+            models.User.is_admin,
+            models.User.created_at
+        )
+        if cursor is not None:
+            query = query.filter(models.User.id > cursor)
+        # Fetch one extra row to know whether there is another page
+        users = query.order_by(models.User.id).limit(limit + 1).all()
+        next_cursor = users[limit - 1].id if len(users) > limit else None
+        return ORJSONResponse({
+            "users": [user._asdict() for user in users[:limit]],
+            "next_cursor": next_cursor
+        })
     except Exception as e:
         logger.error(f"Error getting all users: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -1000,17 +1104,40 @@ def update_user(
 ):
     """Update a user (admin only)"""
     try:
-        user = db.query(models.User).filter(models.User.id == user_id).first()
+        user_columns = (
+            models.User.id,
+            models.User.email,
+            models.User.username,
+            models.User.is_active,
+            models.User.is_admin,
+            models.User.created_at
+        )
+        updates = user_update.model_dump(exclude_unset=True)
+        if not updates:
+            user = db.query(*user_columns).filter(models.User.id == user_id).first()
+            if not user:
+                raise HTTPException(status_code=404, detail="User not found")
+            return user._asdict()
+        
+        # Check if the new email or username is already taken by someone else
+        check_user_conflicts(db, user_id, user_update.email, user_update.username)
+        
+        # Apply the changes and read the updated row back in one statement
+        user = db.execute(
+            update(models.User)
+            .where(models.User.id == user_id)
+            .values(**updates)
+            .returning(*user_columns)
+        ).first()
         if not user:
+            db.rollback()
             raise HTTPException(status_code=404, detail="User not found")
         
-        # Update user fields
-        for field, value in user_update.dict(exclude_unset=True).items():
-            setattr(user, field, value)
-        
         db.commit()
-        db.refresh(user)
-        return user
+        invalidate_cached_user(user_id)
+        return user._asdict()
+    except HTTPException as he:
+        raise he
     except Exception as e:
         logger.error(f"Error updating user: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -1029,12 +1156,16 @@ def delete_user(
         
         # Don't allow deleting the last admin
         if user.is_admin:
-            admin_count = db.query(models.User).filter(models.User.is_admin == True).count()
-            if admin_count <= 1:
+            other_admin = db.query(models.User.id).filter(
+                models.User.is_admin == True,
+                models.User.id != user_id
+            ).limit(1).first()
+            if not other_admin:
                 raise HTTPException(status_code=400, detail="Cannot delete the last admin user")
         
         db.delete(user)
         db.commit()
+        invalidate_cached_user(user_id)
         return {"message": "User deleted successfully"}
     except Exception as e:
         logger.error(f"Error deleting user: {str(e)}")
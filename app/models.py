@@ -1,5 +1,5 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime, Text, Enum
-from sqlalchemy.orm import relationship
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime, Text, Enum, Index
+from sqlalchemy.orm import relationship, backref
 from sqlalchemy.sql import func
 import enum
 from datetime import datetime
@@ -20,7 +20,6 @@ class User(Base):
 
     files = relationship("File", back_populates="owner")
     shared_files = relationship("FileShare", back_populates="shared_with")
-    created_versions = relationship("FileVersion", back_populates="created_by_user")
 
 class FileType(str, enum.Enum):
     FILE = "file"
@@ -42,9 +41,15 @@ class FileVersion(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     comment = Column(String, nullable=True)
     is_current = Column(Boolean, default=True)
+    content_hash = Column(String(32), nullable=True) # blake2b of local version files
 
     file = relationship("File", back_populates="versions")
 
+    __table_args__ = (
+        # Version history is read newest-first per file
+        Index("ix_fileversion_file_version", file_id, version_number.desc()),
+    )
+
 class File(Base):
     __tablename__ = "files"
 
@@ -63,13 +68,19 @@ class File(Base):
     is_deleted = Column(Boolean, default=False)
     version = Column(Integer, default=1)
     mime_type = Column(String, nullable=True)
+    status = Column(String, default='ready') # 'uploading', 'ready' or 'failed'
 
     owner = relationship("User", back_populates="files")
     shares = relationship("FileShare", back_populates="file")
     # Relationship for children files/folders within this folder
-    children = relationship("File", backref="parent", remote_side=[id])
+    children = relationship("File", backref=backref("parent", remote_side=[id]))
     versions = relationship("FileVersion", back_populates="file", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # Listing endpoints filter on (owner_id, parent_id) and skip deleted files
+        Index("ix_files_owner_parent", owner_id, parent_id, is_deleted),
+    )
+
 class FileShare(Base):
     __tablename__ = "file_shares"
 
@@ -80,4 +91,11 @@ class FileShare(Base):
     share_date = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
     file = relationship("File", back_populates="shares")
-    shared_with = relationship("User", back_populates="shared_files") 
\ No newline at end of file
+    shared_with = relationship("User", back_populates="shared_files")
+
+    __table_args__ = (
+        # A file is shared at most once per user; also backs the share upsert
+        Index("ix_shares_file_user", file_id, shared_with_id, unique=True),
+        # "Shared with me" listings filter on the user and sort by newest share
+        Index("ix_shares_user_date", shared_with_id, share_date.desc()),
+    ) 
\ No newline at end of file
@@ -1,7 +1,6 @@
-from pydantic import BaseModel, EmailStr
-from typing import List, Optional
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, TypeAdapter
+from typing import List, Literal, Optional
 from datetime import datetime
-from pydantic import validator
 from .models import PermissionType
 
 class UserBase(BaseModel):
@@ -18,8 +17,7 @@ class User(UserBase):
     created_at: datetime
     updated_at: Optional[datetime] = None
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class UserUpdate(BaseModel):
     username: Optional[str] = None
@@ -56,9 +54,13 @@ class File(FileBase):
     updated_at: Optional[datetime] = None
     is_deleted: bool = False
     version: int = 1
+    status: Literal['uploading', 'ready', 'failed'] = Field(
+        'ready',
+        description="Uploads are accepted with 'uploading' and become 'ready' or 'failed' once the "
+                    "S3 upload finishes; poll GET /files/{file_id}. Content and download return 409 until 'ready'."
+    )
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class FileShareBase(BaseModel):
     file_id: int
@@ -75,8 +77,7 @@ class FileShare(FileShareBase):
     id: int
     share_date: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class MoveItem(BaseModel):
     target_parent_id: Optional[int] = None
@@ -95,24 +96,19 @@ class FileVersion(BaseModel):
     file_id: int
     file_path: str
     created_at: datetime
-    created_by: int
     version_number: int
     file_size: int
     comment: Optional[str] = None
     is_current: bool = False
 
-    class Config:
-        from_attributes = True
-
-class FileVersionWithUser(FileVersion):
-    created_by: User
-
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class FolderCreate(BaseModel):
     name: str
     parent_id: Optional[int] = None
 
 class FileMove(BaseModel):
-    target_parent_id: Optional[int] = None 
\ No newline at end of file
+    target_parent_id: Optional[int] = None
+
+# Built once at import so list responses reuse the same validator/serializer
+FILE_SHARE_LIST_ADAPTER = TypeAdapter(List[FileShare])
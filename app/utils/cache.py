@@ -0,0 +1,45 @@
+import redis
+import os
+import json
+import logging
+from typing import Optional
+from dotenv import load_dotenv
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# Caching is enabled only when REDIS_URL is set; without it every lookup misses
+REDIS_URL = os.getenv("REDIS_URL")
+redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True) if REDIS_URL else None
+
+def cache_get(key: str) -> Optional[dict]:
+    """Get a cached JSON value, or None on a miss or cache error"""
+    if redis_client is None:
+        return None
+    try:
+        value = redis_client.get(key)
+        return json.loads(value) if value is not None else None
+    except redis.RedisError as e:
+        logger.error(f"Error reading cache key {key}: {str(e)}")
+        return None
+
+def cache_set(key: str, value: dict, ttl: int) -> None:
+    """Cache a JSON-serializable value for ttl seconds"""
+    if redis_client is None:
+        return
+    try:
+        redis_client.setex(key, ttl, json.dumps(value, default=str))
+    except redis.RedisError as e:
+        logger.error(f"Error writing cache key {key}: {str(e)}")
+
+def cache_delete(key: str) -> None:
+    """Remove a cached value"""
+    if redis_client is None:
+        return
+    try:
+        redis_client.delete(key)
+    except redis.RedisError as e:
+        logger.error(f"Error deleting cache key {key}: {str(e)}")
@@ -1,7 +1,7 @@
 import logging
 from sqlalchemy.orm import Session
 from ..models import File, FileVersion, FileShare
-from .s3_service import S3Service
+from .s3_service import get_s3_service
 from ..database import get_db
 
 # Configure logging
@@ -11,30 +11,27 @@ logger = logging.getLogger(__name__)
 def cleanup_storage():
     """Clean up all files and folders from S3 and database"""
     try:
-        # Initialize S3 service
-        s3_service = S3Service()
+        # Use the shared S3 service
+        s3_service = get_s3_service()
         
         # Get database session
         db = next(get_db())
         
-        # Delete all files from S3
-        logger.info("Deleting all files from S3...")
-        files = db.query(File).all()
-        for file in files:
-            try:
-                # Delete all versions of the file from S3
-                versions = db.query(FileVersion).filter(FileVersion.file_id == file.id).all()
-                for version in versions:
-                    if version.file_path:
-                        s3_service.delete_file(version.file_path)
-                        logger.info(f"Deleted version from S3: {version.file_path}")
-                
-                # Delete the current version from S3
-                if file.file_path:
-                    s3_service.delete_file(file.file_path)
-                    logger.info(f"Deleted file from S3: {file.file_path}")
-            except Exception as e:
-                logger.error(f"Error deleting file from S3: {str(e)}")
+        # Collect the S3 keys of all files and their versions
+        logger.info("Collecting files to delete from S3...")
+        # Stream just the paths; a set also drops keys shared by a file and its versions
+        keys = set()
+        for model in (FileVersion, File):
+            paths = db.query(model.file_path).filter(model.file_path.isnot(None)).yield_per(10000)
+            keys.update(path for (path,) in paths)
+        keys = list(keys)
+        
+        # Delete all files from S3, up to 1000 keys per request
+        logger.info(f"Deleting {len(keys)} files from S3...")
+        try:
+            s3_service.delete_files(keys)
+        except Exception as e:
+            logger.error(f"Error deleting files from S3: {str(e)}")
         
         # Delete all records from database
         logger.info("Deleting all records from database...")
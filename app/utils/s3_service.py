@@ -1,74 +1,234 @@
 import boto3
 import os
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
-from typing import Optional, BinaryIO
+from typing import Any, Optional, BinaryIO, Iterator, List, Set, Tuple
 from dotenv import load_dotenv
 import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging; the application configures handlers and levels
 logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv()
 
+# Maximum number of keys S3 accepts in a single DeleteObjects request
+DELETE_BATCH_SIZE = 1000
+# Concurrent DeleteObjects requests; stays within the client's connection pool
+DELETE_MAX_WORKERS = 10
+# Objects larger than this are downloaded as concurrent byte-range GETs
+RANGED_DOWNLOAD_THRESHOLD = 16 * 1024 * 1024
+RANGED_DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+RANGED_DOWNLOAD_MAX_WORKERS = 10
+# Uploads over the threshold are sent as concurrent multipart PUTs
+UPLOAD_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=10,
+    use_threads=True
+)
+# Presigned URLs kept in memory, reused for 90% of their lifetime
+URL_CACHE_MAX_SIZE = 10_000
+URL_CACHE_LIFETIME_FRACTION = 0.9
+# HEAD results kept in memory. Keys are overwritten by same-name uploads from
+# other workers, so entries are short-lived, and misses shorter still
+HEAD_CACHE_MAX_SIZE = 50_000
+HEAD_CACHE_TTL_SECONDS = 300
+HEAD_CACHE_MISS_TTL_SECONDS = 30
+# Kept-alive HTTP connections shared by all threads using the client. Multipart
+# uploads, ranged downloads and batched deletes each fan out up to 10 requests,
+# so a few concurrent transfers need well over botocore's default of 10
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", max(50, (os.cpu_count() or 1) * 5)))
+
+# Content types by file extension, used for uploads and presigned URL overrides
+CONTENT_TYPES = {
+    '.pdf': 'application/pdf',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.txt': 'text/plain',
+    '.html': 'text/html',
+    '.css': 'text/css',
+    '.js': 'application/javascript',
+    '.json': 'application/json',
+    '.xml': 'application/xml',
+    '.py': 'text/x-python',
+    '.java': 'text/x-java',
+    '.cpp': 'text/x-c++',
+    '.c': 'text/x-c',
+    '.php': 'text/x-php',
+    '.rb': 'text/x-ruby',
+    '.swift': 'text/x-swift'
+}
+DEFAULT_CONTENT_TYPE = 'application/octet-stream'
+
+# CORS rules for the bucket, applied by configure_bucket_cors
+CORS_CONFIGURATION = {
+    'CORSRules': [{
+        'AllowedHeaders': ['*'],
+        'AllowedMethods': ['GET', 'PUT', 'POST', 'DELETE', 'HEAD'],
+        'AllowedOrigins': [
+            'https://mydrive-frontend.vercel.app',
+            'https://mydrive-frontend-git-main-jukalemanmath.vercel.app',
+            'https://mydrive-frontend-jukalemanmath.vercel.app',
+            'http://localhost:3000'
+        ],
+        'ExposeHeaders': ['ETag', 'Content-Length', 'Content-Type', 'Content-Disposition'],
+        'MaxAgeSeconds': 3600
+    }]
+}
+
+class _ExpiringLRU:
+    """Thread-safe LRU whose entries each carry their own expiry"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
 class S3Service:
+    """Blocking S3 client wrapper. Call it from sync (`def`) endpoints or background
+    tasks, which FastAPI runs in its threadpool, never from an `async def` handler."""
+
     def __init__(self):
         self.s3_client = boto3.client(
             's3',
             aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
             aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-            region_name=os.getenv('AWS_REGION')
+            region_name=os.getenv('AWS_REGION'),
+            config=Config(
+                max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                retries={'mode': 'adaptive', 'max_attempts': 10},
+                tcp_keepalive=True
+            )
         )
         self.bucket_name = os.getenv('S3_BUCKET_NAME')
         if not self.bucket_name:
             raise ValueError("S3_BUCKET_NAME environment variable is not set")
-        logger.info(f"Initialized S3 service with bucket: {self.bucket_name}")
-        
-        # Configure CORS for the bucket
-        cors_configuration = {
-            'CORSRules': [{
-                'AllowedHeaders': ['*'],
-                'AllowedMethods': ['GET', 'PUT', 'POST', 'DELETE', 'HEAD'],
-                'AllowedOrigins': [
-                    'https://mydrive-frontend.vercel.app',
-                    'https://mydrive-frontend-git-main-jukalemanmath.vercel.app',
-                    'https://mydrive-frontend-jukalemanmath.vercel.app',
-                    'http://localhost:3000'
-                ],
-                'ExposeHeaders': ['ETag', 'Content-Length', 'Content-Type', 'Content-Disposition'],
-                'MaxAgeSeconds': 3600
-            }]
-        }
-        logger.info(f"Configuring CORS for S3 bucket with origins: {cors_configuration['CORSRules'][0]['AllowedOrigins']}")
+        logger.info("Initialized S3 service with bucket: %s", self.bucket_name)
+
+        # Presigned URLs and HEAD metadata, so hot objects aren't re-signed or re-checked
+        self._url_cache = _ExpiringLRU(URL_CACHE_MAX_SIZE)
+        self._head_cache = _ExpiringLRU(HEAD_CACHE_MAX_SIZE)
+
+    def configure_bucket_cors(self) -> bool:
+        """Apply the bucket CORS rules. Run once at deploy time (configure_s3_cors.py),
+        not on every service construction."""
+        logger.info("Configuring CORS for S3 bucket with origins: %s", CORS_CONFIGURATION['CORSRules'][0]['AllowedOrigins'])
         try:
             self.s3_client.put_bucket_cors(
                 Bucket=self.bucket_name,
-                CORSConfiguration=cors_configuration
+                CORSConfiguration=CORS_CONFIGURATION
             )
             logger.info("CORS configuration applied successfully")
+            return True
         except Exception as e:
             logger.error(f"Error configuring CORS: {str(e)}")
+            return False
+
+    def get_upload_key(self, file_name: str, user_id: str) -> str:
+        """Get the S3 key a user's upload is stored under"""
+        return f"uploads/{user_id}/{file_name}"
 
     def upload_file(self, file: BinaryIO, file_name: str, user_id: str) -> str:
         """Upload a file to S3"""
         try:
-            key = f"uploads/{user_id}/{file_name}"
-            logger.info(f"Uploading file to S3: {key}")
-            self.s3_client.upload_fileobj(file, self.bucket_name, key)
-            logger.info(f"File uploaded successfully to S3: {key}")
+            key = self.get_upload_key(file_name, user_id)
+            logger.info("Uploading file to S3: %s", key)
+            self.s3_client.upload_fileobj(
+                file,
+                self.bucket_name,
+                key,
+                ExtraArgs={'ContentType': self._get_content_type(key)},
+                Config=UPLOAD_TRANSFER_CONFIG
+            )
+            self.invalidate(key)
+            logger.info("File uploaded successfully to S3: %s", key)
             return key
         except ClientError as e:
             logger.error(f"Error uploading file to S3: {str(e)}")
             raise Exception(f"Error uploading file to S3: {str(e)}")
 
-    def download_file(self, key: str) -> bytes:
-        """Download a file from S3"""
+    def download_file(self, key: str, size: Optional[int] = None) -> bytes:
+        """Download a file from S3.
+
+        Large objects are fetched as concurrent byte ranges written into one
+        preallocated buffer. Pass the known size to skip the HEAD request.
+        """
         try:
-            logger.info(f"Downloading file from S3: {key}")
-            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=key)
-            content = response['Body'].read()
-            logger.info(f"File downloaded successfully from S3: {key}")
+            logger.info("Downloading file from S3: %s", key)
+            if size is None:
+                size = self.get_file_size(key)
+            if size <= RANGED_DOWNLOAD_THRESHOLD:
+                response = self.s3_client.get_object(Bucket=self.bucket_name, Key=key)
+                content = response['Body'].read()
+            else:
+                # The size above may come from a cached HEAD, so the first range is fetched on
+                # its own to pin the object's ETag and actual size. The other ranges are sent
+                # with IfMatch, so an overwrite mid-download fails instead of mixing two objects
+                first = self.s3_client.get_object(
+                    Bucket=self.bucket_name,
+                    Key=key,
+                    Range=f'bytes=0-{RANGED_DOWNLOAD_CHUNK_SIZE - 1}'
+                )
+                etag = first['ETag']
+                size = int(first['ContentRange'].rsplit('/', 1)[1])
+                buffer = bytearray(size)
+                view = memoryview(buffer)
+
+                def read_into(body, offset: int) -> None:
+                    for chunk in body.iter_chunks(chunk_size=1024 * 1024):
+                        view[offset:offset + len(chunk)] = chunk
+                        offset += len(chunk)
+
+                def fetch_range(start: int) -> None:
+                    end = min(start + RANGED_DOWNLOAD_CHUNK_SIZE, size) - 1
+                    response = self.s3_client.get_object(
+                        Bucket=self.bucket_name,
+                        Key=key,
+                        Range=f'bytes={start}-{end}',
+                        IfMatch=etag
+                    )
+                    read_into(response['Body'], start)
+
+                read_into(first['Body'], 0)
+                with ThreadPoolExecutor(max_workers=RANGED_DOWNLOAD_MAX_WORKERS) as executor:
+                    list(executor.map(fetch_range, range(RANGED_DOWNLOAD_CHUNK_SIZE, size, RANGED_DOWNLOAD_CHUNK_SIZE)))
+                # Returned without copying; bytearray is accepted wherever bytes are read
+                content = buffer
+            logger.info("File downloaded successfully from S3: %s", key)
             return content
         except ClientError as e:
             logger.error(f"Error downloading file from S3: {str(e)}")
@@ -77,90 +237,232 @@ class S3Service:
     def delete_file(self, key: str) -> bool:
         """Delete a file from S3"""
         try:
-            logger.info(f"Deleting file from S3: {key}")
+            logger.info("Deleting file from S3: %s", key)
             self.s3_client.delete_object(Bucket=self.bucket_name, Key=key)
-            logger.info(f"File deleted successfully from S3: {key}")
+            self.invalidate(key)
+            logger.info("File deleted successfully from S3: %s", key)
             return True
         except ClientError as e:
             logger.error(f"Error deleting file from S3: {str(e)}")
             raise Exception(f"Error deleting file from S3: {str(e)}")
 
-    def get_file_url(self, key: str, expires_in: int = 3600) -> str:
-        """Generate a presigned URL for a file"""
+    def copy_file(self, source_key: str, dest_key: str) -> int:
+        """Copy an object within the bucket server-side; returns the copy's size in bytes.
+
+        Managed copy switches to multipart UploadPartCopy for large objects,
+        so the bytes never pass through this process.
+        """
         try:
-            logger.info(f"Generating presigned URL for file: {key}")
+            logger.info("Copying file in S3: %s -> %s", source_key, dest_key)
+            self.s3_client.copy(
+                {'Bucket': self.bucket_name, 'Key': source_key},
+                self.bucket_name,
+                dest_key,
+                Config=UPLOAD_TRANSFER_CONFIG
+            )
+            self.invalidate(dest_key)
+            logger.info("File copied successfully in S3: %s", dest_key)
+        except ClientError as e:
+            logger.error(f"Error copying file in S3: {str(e)}")
+            raise Exception(f"Error copying file in S3: {str(e)}")
+        return self.get_file_size(dest_key)
+
+    def _delete_batch(self, batch: List[str]) -> int:
+        """Delete up to DELETE_BATCH_SIZE keys in one DeleteObjects call; returns the number deleted"""
+        try:
+            response = self.s3_client.delete_objects(
+                Bucket=self.bucket_name,
+                Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+            )
+        except ClientError as e:
+            logger.error(f"Error deleting files from S3: {str(e)}")
+            raise Exception(f"Error deleting files from S3: {str(e)}")
+        for key in batch:
+            self.invalidate(key)
+        errors = response.get('Errors', [])
+        for error in errors:
+            logger.error(f"Error deleting file from S3: {error['Key']}: {error['Message']}")
+        return len(batch) - len(errors)
+
+    def delete_files(self, keys: List[str]) -> int:
+        """Delete many files from S3 using batched DeleteObjects calls; returns the number of keys deleted"""
+        batches = [keys[start:start + DELETE_BATCH_SIZE] for start in range(0, len(keys), DELETE_BATCH_SIZE)]
+        if not batches:
+            return 0
+        # Batches are independent, so send them concurrently; the boto3 client is thread-safe
+        with ThreadPoolExecutor(max_workers=min(DELETE_MAX_WORKERS, len(batches))) as executor:
+            deleted = sum(executor.map(self._delete_batch, batches))
+        logger.info("Deleted %s files from S3", deleted)
+        return deleted
+
+    def get_file_url(
+        self,
+        key: str,
+        expires_in: int = 3600,
+        disposition: str = 'inline',
+        filename: Optional[str] = None,
+        content_type: Optional[str] = None
+    ) -> str:
+        """Generate a presigned URL for a file.
+
+        The disposition, filename and content type are passed as response
+        overrides so S3 serves the object with the right headers. Signed URLs
+        are reused until 90% of their lifetime has passed, so a returned URL
+        may have only a tenth of expires_in left; callers that keep the URL
+        should use get_file_url_with_expiry.
+        """
+        return self.get_file_url_with_expiry(key, expires_in, disposition, filename, content_type)[0]
+
+    def get_file_url_with_expiry(
+        self,
+        key: str,
+        expires_in: int = 3600,
+        disposition: str = 'inline',
+        filename: Optional[str] = None,
+        content_type: Optional[str] = None
+    ) -> Tuple[str, float]:
+        """Like get_file_url, but also return when the URL expires, as a Unix timestamp"""
+        cache_key = (key, expires_in, disposition, filename, content_type)
+        cached = self._url_cache.get(cache_key)
+        if cached:
+            return cached
+        try:
+            logger.info("Generating presigned URL for file: %s", key)
+            # Taken before signing so the expiry is never later than the one S3 enforces
+            expires_at = time.time() + expires_in
             url = self.s3_client.generate_presigned_url(
                 'get_object',
                 Params={
                     'Bucket': self.bucket_name,
                     'Key': key,
-                    'ResponseContentDisposition': f'inline; filename="{os.path.basename(key)}"',
-                    'ResponseContentType': self._get_content_type(key)
+                    'ResponseContentDisposition': f'{disposition}; filename="{filename or os.path.basename(key)}"',
+                    'ResponseContentType': content_type or self._get_content_type(key)
                 },
                 ExpiresIn=expires_in
             )
-            logger.info(f"Generated presigned URL successfully for file: {key}")
-            return url
+            logger.info("Generated presigned URL successfully for file: %s", key)
         except ClientError as e:
             logger.error(f"Error generating presigned URL: {str(e)}")
             raise Exception(f"Error generating presigned URL: {str(e)}")
+        self._url_cache.set(cache_key, (url, expires_at), expires_in * URL_CACHE_LIFETIME_FRACTION)
+        return url, expires_at
 
     def _get_content_type(self, key: str) -> str:
         """Get the content type based on file extension"""
-        ext = os.path.splitext(key)[1].lower()
-        content_types = {
-            '.pdf': 'application/pdf',
-            '.jpg': 'image/jpeg',
-            '.jpeg': 'image/jpeg',
-            '.png': 'image/png',
-            '.gif': 'image/gif',
-            '.txt': 'text/plain',
-            '.html': 'text/html',
-            '.css': 'text/css',
-            '.js': 'application/javascript',
-            '.json': 'application/json',
-            '.xml': 'application/xml',
-            '.py': 'text/x-python',
-            '.java': 'text/x-java',
-            '.cpp': 'text/x-c++',
-            '.c': 'text/x-c',
-            '.php': 'text/x-php',
-            '.rb': 'text/x-ruby',
-            '.swift': 'text/x-swift'
-        }
-        return content_types.get(ext, 'application/octet-stream')
+        return CONTENT_TYPES.get(os.path.splitext(key)[1].lower(), DEFAULT_CONTENT_TYPE)
+
+    def invalidate(self, key: str) -> None:
+        """Drop cached HEAD metadata for a key after it is written or deleted"""
+        self._head_cache.pop(key)
+
+    def clear_caches(self) -> None:
+        """Drop all cached URLs and HEAD metadata, e.g. after the bucket is replaced"""
+        self._url_cache.clear()
+        self._head_cache.clear()
+
+    def _head(self, key: str) -> dict:
+        """Get {'exists', 'size', 'etag'} for a key, from the cache when possible"""
+        metadata = self._head_cache.get(key)
+        if metadata is not None:
+            return metadata
+        try:
+            response = self.s3_client.head_object(Bucket=self.bucket_name, Key=key)
+            metadata = {'exists': True, 'size': response['ContentLength'], 'etag': response.get('ETag')}
+            self._head_cache.set(key, metadata, HEAD_CACHE_TTL_SECONDS)
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+                raise
+            metadata = {'exists': False, 'size': None, 'etag': None}
+            self._head_cache.set(key, metadata, HEAD_CACHE_MISS_TTL_SECONDS)
+        return metadata
 
     def get_file_size(self, key: str) -> int:
         """Get file size in bytes from S3"""
         try:
-            logger.info(f"Getting file size from S3: {key}")
-            response = self.s3_client.head_object(Bucket=self.bucket_name, Key=key)
-            size = response['ContentLength']
-            logger.info(f"File size: {size} bytes")
-            return size
+            logger.info("Getting file size from S3: %s", key)
+            metadata = self._head(key)
         except ClientError as e:
             logger.error(f"Error getting file size from S3: {str(e)}")
             raise Exception(f"Error getting file size from S3: {str(e)}")
+        if not metadata['exists']:
+            logger.error(f"Error getting file size from S3: {key} not found")
+            raise Exception(f"Error getting file size from S3: {key} not found")
+        logger.info("File size: %s bytes", metadata['size'])
+        return metadata['size']
 
     def file_exists(self, key: str) -> bool:
         """Check if a file exists in S3"""
         try:
-            logger.info(f"Checking if file exists in S3: {key}")
-            self.s3_client.head_object(Bucket=self.bucket_name, Key=key)
-            return True
+            logger.info("Checking if file exists in S3: %s", key)
+            return self._head(key)['exists']
         except ClientError as e:
-            if e.response['Error']['Code'] == '404':
-                return False
             raise Exception(f"Error checking file existence in S3: {str(e)}")
 
-    def get_file(self, key: str) -> bytes:
-        """Retrieve file content from S3"""
+    def iter_objects(self, prefix: str) -> Iterator[List[dict]]:
+        """Yield the objects under a prefix one ListObjectsV2 page (up to 1000) at a time"""
         try:
-            logger.info(f"Retrieving file from S3: {key}")
-            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=key)
+            paginator = self.s3_client.get_paginator('list_objects_v2')
+            for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+                yield page.get('Contents', [])
+        except ClientError as e:
+            logger.error(f"Error listing files in S3: {str(e)}")
+            raise Exception(f"Error listing files in S3: {str(e)}")
+
+    def existing_keys(self, prefix: str) -> Set[str]:
+        """List every key under a prefix with paginated ListObjectsV2 calls, rather than
+        one HEAD per key, and seed the HEAD cache from the listing"""
+        keys = set()
+        for objects in self.iter_objects(prefix):
+            for obj in objects:
+                keys.add(obj['Key'])
+                self._head_cache.set(
+                    obj['Key'],
+                    {'exists': True, 'size': obj['Size'], 'etag': obj.get('ETag')},
+                    HEAD_CACHE_TTL_SECONDS
+                )
+        return keys
+
+    def delete_prefix(self, prefix: str) -> int:
+        """Delete everything under a prefix, deleting each listed page before fetching the next;
+        returns the number of keys deleted"""
+        return sum(self.delete_files([obj['Key'] for obj in objects]) for objects in self.iter_objects(prefix))
+
+    def get_file(self, key: str, max_bytes: Optional[int] = None) -> bytes:
+        """Retrieve file content from S3, optionally only the first max_bytes bytes"""
+        try:
+            logger.info("Retrieving file from S3: %s", key)
+            params = {'Bucket': self.bucket_name, 'Key': key}
+            if max_bytes is not None:
+                params['Range'] = f'bytes=0-{max_bytes - 1}'
+            response = self.s3_client.get_object(**params)
             content = response['Body'].read()
-            logger.info(f"File retrieved successfully from S3: {key}")
+            logger.info("File retrieved successfully from S3: %s", key)
             return content
         except ClientError as e:
+            # S3 rejects any byte range on an empty object
+            if max_bytes is not None and e.response.get('Error', {}).get('Code') == 'InvalidRange':
+                return b''
             logger.error(f"Error retrieving file from S3: {str(e)}")
-            raise Exception(f"Error retrieving file from S3: {str(e)}") 
\ No newline at end of file
+            raise Exception(f"Error retrieving file from S3: {str(e)}")
+
+    def get_file_stream(self, key: str, chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+        """Stream file content from S3 in chunks without buffering the whole object"""
+        try:
+            logger.info("Streaming file from S3: %s", key)
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=key)
+            return response['Body'].iter_chunks(chunk_size=chunk_size)
+        except ClientError as e:
+            logger.error(f"Error streaming file from S3: {str(e)}")
+            raise Exception(f"Error streaming file from S3: {str(e)}")
+
+_s3_service: Optional[S3Service] = None
+_s3_service_lock = threading.Lock()
+
+def get_s3_service() -> S3Service:
+    """Get the process-wide S3Service, so every caller shares one client and its connection pool"""
+    global _s3_service
+    if _s3_service is None:
+        with _s3_service_lock:
+            if _s3_service is None:
+                _s3_service = S3Service()
+    return _s3_service
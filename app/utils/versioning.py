@@ -1,9 +1,29 @@
 import os
 import shutil
+import hashlib
+import mmap
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
 from ..models import FileVersion, File
-from sqlalchemy.orm import Session
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session, load_only
+from .s3_service import get_s3_service
+
+# Concurrent unlinks when deleting local version files
+VERSION_DELETE_MAX_WORKERS = 16
+
+def is_s3_key(path: str) -> bool:
+    """Uploaded files are stored in S3 under uploads/; anything else is a local path"""
+    return path.startswith('uploads/')
+
+def hash_file(path: str) -> str:
+    """Hash a local file with blake2b, reading it through mmap rather than in chunks"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashlib.blake2b(b'', digest_size=16).hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return hashlib.blake2b(mm, digest_size=16).hexdigest()
 
 def create_version(
     db: Session,
@@ -13,53 +33,76 @@ def create_version(
 ) -> FileVersion:
     """
     Create a new version of a file.
+    
+    For local files whose content matches the current version, no new version
+    is made: the current one is returned, with comment (if given) recorded on it.
     """
     try:
-        # Get the latest version number
-        latest_version = db.query(FileVersion)\
-            .filter(FileVersion.file_id == file.id)\
-            .order_by(FileVersion.version_number.desc())\
-            .first()
-        
-        # Set the new version number
-        new_version_number = 1 if latest_version is None else latest_version.version_number + 1
+        # Lock the file row and get the next version number in one query, so
+        # concurrent version creations for the same file can't pick the same number
+        new_version_number = db.execute(text("""
+            SELECT (
+                SELECT COALESCE(MAX(version_number), 0) + 1
+                FROM file_versions
+                WHERE file_id = f.id
+            )
+            FROM files f
+            WHERE f.id = :file_id
+            FOR UPDATE
+        """), {"file_id": file.id}).scalar_one()
         
-        # Create version directory if it doesn't exist
-        version_dir = os.path.join(os.path.dirname(file.file_path), 'versions')
-        if not os.path.exists(version_dir):
-            os.makedirs(version_dir)
-        
-        # Create the version path
-        version_path = os.path.join(version_dir, f'v{new_version_number}_{os.path.basename(file.file_path)}')
-        
-        # Read the current file content
-        with open(file.file_path, 'rb') as src_file:
-            content = src_file.read()
-        
-        # Write the content to the version file
-        with open(version_path, 'wb') as dst_file:
-            dst_file.write(content)
+        version_name = f'v{new_version_number}_{os.path.basename(file.file_path)}'
+        content_hash = None
+        if is_s3_key(file.file_path):
+            # Copy inside S3 so the bytes never leave the bucket
+            version_path = f'{os.path.dirname(file.file_path)}/versions/{version_name}'
+            file_size = get_s3_service().copy_file(file.file_path, version_path)
+        else:
+            # If the content hasn't changed since the current version, keep using it
+            content_hash = hash_file(file.file_path)
+            current_version = db.query(FileVersion).filter(
+                FileVersion.file_id == file.id,
+                FileVersion.is_current == True,
+                FileVersion.content_hash == content_hash
+            ).first()
+            if current_version:
+                if comment is not None:
+                    current_version.comment = comment
+                db.commit()
+                return current_version
+            
+            # Create version directory if it doesn't exist
+            version_dir = os.path.join(os.path.dirname(file.file_path), 'versions')
+            if not os.path.exists(version_dir):
+                os.makedirs(version_dir)
+            
+            # Copy the current file to the version file; copyfile uses the kernel's
+            # zero-copy path where available instead of reading it into memory
+            version_path = os.path.join(version_dir, version_name)
+            shutil.copyfile(file.file_path, version_path)
+            file_size = os.path.getsize(version_path)
         
         # Create the version record
         version = FileVersion(
             file_id=file.id,
             file_path=version_path,
             created_at=datetime.utcnow(),
-            created_by=user_id,
             version_number=new_version_number,
-            file_size=len(content),
+            file_size=file_size,
+            content_hash=content_hash,
             comment=comment,
             is_current=True
         )
         
         # Mark all other versions as not current
         db.query(FileVersion)\
-            .filter(FileVersion.file_id == file.id)\
-            .update({"is_current": False})
+            .filter(FileVersion.file_id == file.id, FileVersion.is_current == True)\
+            .update({"is_current": False}, synchronize_session=False)
         
+        # The flush INSERTs with RETURNING id, so no refresh is needed afterwards
         db.add(version)
+        db.flush()
         db.commit()
-        db.refresh(version)
         
         return version
     except Exception as e:
@@ -77,8 +120,15 @@ def restore_version(
     try:
         file = version.file
         
-        # Copy the restored version's content to the current file
-        shutil.copy2(version.file_path, file.file_path)
+        # Copy the restored version's content to the current file. A version stored
+        # at the file's own path already holds the current content, so skip copying
+        # an object onto itself
+        if version.file_path != file.file_path:
+            detach_versions(db, file)
+            if is_s3_key(version.file_path):
+                get_s3_service().copy_file(version.file_path, file.file_path)
+            else:
+                shutil.copy2(version.file_path, file.file_path)
         
         # Create a new version from the restored version
         new_version = create_version(
@@ -93,6 +143,27 @@ def restore_version(
         db.rollback()
         raise e
 
+def detach_versions(db: Session, file: File) -> None:
+    """
+    Give versions stored at the file's own path (the first version is recorded
+    that way at upload) their own copy, so overwriting the file keeps their content.
+    """
+    versions = db.query(FileVersion).filter(
+        FileVersion.file_id == file.id,
+        FileVersion.file_path == file.file_path
+    ).all()
+    for version in versions:
+        version_name = f'v{version.version_number}_{os.path.basename(file.file_path)}'
+        if is_s3_key(file.file_path):
+            version.file_path = f'{os.path.dirname(file.file_path)}/versions/{version_name}'
+            get_s3_service().copy_file(file.file_path, version.file_path)
+        else:
+            version_dir = os.path.join(os.path.dirname(file.file_path), 'versions')
+            os.makedirs(version_dir, exist_ok=True)
+            version.file_path = os.path.join(version_dir, version_name)
+            shutil.copyfile(file.file_path, version.file_path)
+    db.flush()
+
 def delete_version(db: Session, file: File, version_number: int) -> None:
     """
     Delete a specific version of a file.
@@ -105,42 +176,113 @@ def delete_version(db: Session, file: File, version_number: int) -> None:
     Raises:
         ValueError: If version is current or not found
     """
-    # Get the version
-    version = db.query(FileVersion).filter(
-        FileVersion.file_id == file.id,
-        FileVersion.version_number == version_number
-    ).first()
+    delete_versions(db, file, [version_number])
+
+def delete_versions(db: Session, file: File, version_numbers: List[int]) -> None:
+    """
+    Delete several versions of a file with one query and one DELETE, then
+    remove their stored copies concurrently.
     
-    if not version:
-        raise ValueError("Version not found")
+    Args:
+        db: Database session
+        file: File model instance
+        version_numbers: Version numbers to delete
         
-    # Get the latest version number for this file
-    latest_version = db.query(FileVersion).filter(
+    Raises:
+        ValueError: If any version is current or not found
+    """
+    requested = set(version_numbers)
+    if not requested:
+        return
+    
+    # Get the versions along with the latest version number for this file. Locking
+    # the file row (as create_version does) stops a new version from being added
+    # between this check and the delete
+    latest_version_number = db.query(func.max(FileVersion.version_number)).filter(
         FileVersion.file_id == file.id
-    ).order_by(FileVersion.version_number.desc()).first()
-    if latest_version and version.version_number == latest_version.version_number:
+    ).correlate(None).scalar_subquery()
+    versions = db.query(
+        FileVersion.id,
+        FileVersion.version_number,
+        FileVersion.file_path,
+        latest_version_number.label("latest_version_number")
+    ).join(
+        File, File.id == FileVersion.file_id
+    ).filter(
+        FileVersion.file_id == file.id,
+        FileVersion.version_number.in_(requested)
+    ).with_for_update(of=(File, FileVersion)).all()
+    
+    if len(versions) != len(requested):
+        raise ValueError("Version not found")
+    if any(version.version_number == version.latest_version_number for version in versions):
         raise ValueError("Cannot delete the current version of a file")
     
+    paths = {version.file_path for version in versions if version.file_path}
     try:
-        # Delete the version file if it exists
-        if version.file_path and os.path.exists(version.file_path):
-            os.remove(version.file_path)
-        
-        # Delete the version record
-        db.delete(version)
+        # Delete the version records
+        db.query(FileVersion).filter(
+            FileVersion.id.in_([version.id for version in versions])
+        ).delete(synchronize_session=False)
+        # The first version shares the file's own path, so only remove stored
+        # copies that neither a file nor a remaining version still points at
+        paths -= get_referenced_paths(db, paths)
         db.commit()
     except Exception as e:
         db.rollback()
         raise ValueError(f"Error deleting version: {str(e)}")
+    
+    # Delete the version files; S3 keys go out in batched DeleteObjects calls
+    s3_keys = [path for path in paths if is_s3_key(path)]
+    local_paths = [path for path in paths if not is_s3_key(path)]
+    try:
+        if s3_keys:
+            get_s3_service().delete_files(s3_keys)
+        if local_paths:
+            with ThreadPoolExecutor(max_workers=min(VERSION_DELETE_MAX_WORKERS, len(local_paths))) as executor:
+                list(executor.map(remove_local_file, local_paths))
+    except Exception as e:
+        raise ValueError(f"Error deleting version: {str(e)}")
+
+def get_referenced_paths(db: Session, paths: set[str]) -> set[str]:
+    """Return the paths in paths that a file or a file version still points at"""
+    if not paths:
+        return set()
+    file_paths = db.query(File.file_path).filter(File.file_path.in_(paths))
+    version_paths = db.query(FileVersion.file_path).filter(FileVersion.file_path.in_(paths))
+    return {path for path, in file_paths.union(version_paths)}
+
+def remove_local_file(path: str) -> None:
+    """Remove a local version file, ignoring one that is already gone"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
 
 def get_version_history(
     db: Session,
-    file_id: int
+    file_id: int,
+    limit: int = 50,
+    before_version: Optional[int] = None
 ) -> list[FileVersion]:
     """
-    Get the version history of a file.
+    Get a page of a file's version history, newest first.
+    
+    Pass the last version_number of a page as before_version to get the next one.
     """
-    return db.query(FileVersion)\
-        .filter(FileVersion.file_id == file_id)\
+    query = db.query(FileVersion)\
+        .options(load_only(
+            FileVersion.id,
+            FileVersion.version_number,
+            FileVersion.created_at,
+            FileVersion.file_size,
+            FileVersion.is_current,
+            FileVersion.comment
+        ))\
+        .filter(FileVersion.file_id == file_id)
+    if before_version is not None:
+        query = query.filter(FileVersion.version_number < before_version)
+    return query\
         .order_by(FileVersion.version_number.desc())\
-        .all() 
\ No newline at end of file
+        .limit(limit)\
+        .all()
@@ -0,0 +1,15 @@
+import sys
+import os
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.s3_service import S3Service
+
+if __name__ == "__main__":
+    print("Configuring S3 bucket CORS...")
+    if S3Service().configure_bucket_cors():
+        print("CORS configuration applied successfully!")
+    else:
+        print("CORS configuration failed. Check the logs for details.")
+        sys.exit(1)
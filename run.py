@@ -6,9 +6,17 @@ from pathlib import Path
 current_dir = Path(__file__).resolve().parent
 sys.path.append(str(current_dir))
 
-# Import and run the FastAPI app
-from app.main import app
 import uvicorn
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="127.0.0.1", port=8000, reload=True) 
\ No newline at end of file
+    # Set RELOAD=true for local development; reload runs a single process
+    reload = os.getenv("RELOAD", "false").lower() == "true"
+    uvicorn.run(
+        "app.main:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=1 if reload else int(os.getenv("WEB_CONCURRENCY", "4")),
+        loop="uvloop",
+        http="httptools",
+        reload=reload
+    ) 
\ No newline at end of file
@@ -1,103 +1,207 @@
+import functools
+import os
+from datetime import timedelta
 import pytest
-from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import pytest_asyncio
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
 from sqlalchemy.pool import StaticPool
 
-from app.database import Base, get_db
+# Tests never measure hashing cost, so use bcrypt's minimum work factor; set before app.auth is imported
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+# Unless real-AWS tests were asked for, serve S3 from moto's in-memory backend. The
+# fake credentials are set before the app loads .env (which doesn't override them),
+# and moto is imported before the app builds its boto3 client so it can intercept it
+MOCK_S3 = os.getenv("RUN_AWS_TESTS") != "1"
+if MOCK_S3:
+    os.environ.update(
+        AWS_ACCESS_KEY_ID="testing",
+        AWS_SECRET_ACCESS_KEY="testing",
+        AWS_REGION="us-east-1",
+        S3_BUCKET_NAME="mydrive-test-bucket",
+    )
+    from moto import mock_aws
+
+from app.database import Base, get_db, get_session_factory
 from app.main import app
 from app import models
-from app.auth import get_password_hash
+from app.auth import get_password_hash, create_access_token
+from app.utils.s3_service import get_s3_service
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "aws: talks to real AWS S3; set RUN_AWS_TESTS=1 to run")
 
-# Create test database
+def pytest_collection_modifyitems(config, items):
+    # Real-S3 tests are opt-in; S3Service itself is covered against moto in test_s3_service.py
+    if os.getenv("RUN_AWS_TESTS") == "1":
+        return
+    skip_aws = pytest.mark.skip(reason="real AWS test; set RUN_AWS_TESTS=1 to run")
+    for item in items:
+        if "aws" in item.keywords:
+            item.add_marker(skip_aws)
+
+# Create test database; StaticPool keeps the single in-memory connection alive
 SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
     connect_args={"check_same_thread": False},
     poolclass=StaticPool,
 )
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-@pytest.fixture(scope="function")
-def db_session():
+# pysqlite's own transaction handling breaks SAVEPOINTs; let SQLAlchemy emit BEGIN itself
+@event.listens_for(engine, "connect")
+def do_connect(dbapi_connection, connection_record):
+    dbapi_connection.isolation_level = None
+
+@event.listens_for(engine, "begin")
+def do_begin(conn):
+    conn.exec_driver_sql("BEGIN")
+
+@pytest.fixture(scope="session", autouse=True)
+def create_schema():
+    # Build the schema once; each test's changes are rolled back instead of dropping tables
     Base.metadata.create_all(bind=engine)
-    db = TestingSessionLocal()
+    yield
+
+@pytest.fixture(scope="session")
+def mock_s3():
+    # One moto backend for the run; restarting the mock for every test costs more than emptying the bucket
+    with mock_aws():
+        s3_service = get_s3_service()
+        s3_service.s3_client.create_bucket(Bucket=s3_service.bucket_name)
+        yield s3_service
+
+@pytest.fixture(autouse=True)
+def s3_backend(request):
+    # Start each test from an empty in-memory bucket; real-AWS tests talk to the configured bucket
+    if not MOCK_S3 or "aws" in request.keywords:
+        return
+    s3_service = request.getfixturevalue("mock_s3")
+    s3_service.delete_prefix("")
+    # The service caches HEADs and URLs across requests; drop any from earlier tests
+    s3_service.clear_caches()
+
+@pytest.fixture(scope="module")
+def connection():
+    # One outer transaction per test module; rows created by the module-scoped user
+    # fixtures live in it and are rolled back when the module finishes
+    connection = engine.connect()
+    transaction = connection.begin()
+    yield connection
+    transaction.rollback()
+    connection.close()
+
+@pytest.fixture(scope="module")
+def module_session(connection):
+    # Session for module-scoped fixtures; objects stay loaded after commit so every test can read them
+    db = Session(bind=connection, expire_on_commit=False, join_transaction_mode="create_savepoint")
+    yield db
+    db.close()
+
+@pytest.fixture(scope="function")
+def db_session(connection):
+    # Run the test inside a SAVEPOINT of the module's transaction; commits made by
+    # the code under test only release nested SAVEPOINTs, and the test's changes
+    # are rolled back afterwards
+    savepoint = connection.begin_nested()
+    db = Session(bind=connection, autoflush=False, join_transaction_mode="create_savepoint")
     try:
         yield db
     finally:
         db.close()
-        Base.metadata.drop_all(bind=engine)
+        savepoint.rollback()
 
-@pytest.fixture(scope="function")
-def client(db_session):
+@pytest.fixture(scope="session")
+def password_hashes():
+    # bcrypt is deliberately slow, so hash each fixture password once per run
+    return {
+        "testpassword": get_password_hash("testpassword"),
+        "adminpassword": get_password_hash("adminpassword"),
+    }
+
+@pytest_asyncio.fixture(scope="function")
+async def client(connection, db_session):
     def override_get_db():
         try:
             yield db_session
         finally:
             pass  # Don't close the session here
     
+    def test_session():
+        # Sessions opened by background tasks join the test's SAVEPOINT instead of using DATABASE_URL
+        return Session(bind=connection, autoflush=False, join_transaction_mode="create_savepoint")
+    
     app.dependency_overrides[get_db] = override_get_db
-    with TestClient(app) as test_client:
+    app.dependency_overrides[get_session_factory] = lambda: test_session
+    # Call the ASGI app in-process on the test's event loop instead of through a portal thread
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as test_client:
         yield test_client
     app.dependency_overrides.clear()
 
-@pytest.fixture(scope="function")
-def test_user(db_session):
+@pytest.fixture(scope="module")
+def test_user(module_session, password_hashes):
     user = models.User(
         email="test@example.com",
         username="testuser",
-        hashed_password=get_password_hash("testpassword")
+        hashed_password=password_hashes["testpassword"]
     )
-    db_session.add(user)
-    db_session.commit()
-    db_session.refresh(user)
+    module_session.add(user)
+    module_session.commit()
+    module_session.refresh(user)
     return user
 
-@pytest.fixture(scope="function")
-def test_user2(db_session):
+@pytest.fixture(scope="module")
+def test_user2(module_session, password_hashes):
     user = models.User(
         email="test2@example.com",
         username="testuser2",
-        hashed_password=get_password_hash("testpassword")
+        hashed_password=password_hashes["testpassword"]
     )
-    db_session.add(user)
-    db_session.commit()
-    db_session.refresh(user)
+    module_session.add(user)
+    module_session.commit()
+    module_session.refresh(user)
     return user
 
-@pytest.fixture(scope="function")
-def test_admin(db_session):
+@pytest.fixture(scope="module")
+def test_admin(module_session, password_hashes):
     admin = models.User(
         email="admin@example.com",
         username="admin",
-        hashed_password=get_password_hash("adminpassword"),
+        hashed_password=password_hashes["adminpassword"],
         is_admin=True
     )
-    db_session.add(admin)
-    db_session.commit()
-    db_session.refresh(admin)
+    module_session.add(admin)
+    module_session.commit()
+    module_session.refresh(admin)
     return admin
 
-@pytest.fixture(scope="function")
-def test_user_token(client, test_user):
-    response = client.post(
-        "/token",
-        data={"username": "testuser", "password": "testpassword"}
-    )
-    return response.json()["access_token"]
+# Tokens are signed in-process like /token does; login itself is covered in test_auth.py.
+# A token only carries the user id, and ids repeat between modules because each
+# module's rows are rolled back, so signed tokens are reused for the whole run
+TOKEN_LIFETIME = timedelta(hours=12)
 
-@pytest.fixture(scope="function")
-def test_admin_token(client, test_admin):
-    response = client.post(
-        "/token",
-        data={"username": "admin", "password": "adminpassword"}
-    )
-    return response.json()["access_token"]
+@functools.lru_cache(maxsize=None)
+def token_for(user_id: int) -> str:
+    return create_access_token(data={"sub": str(user_id)}, expires_delta=TOKEN_LIFETIME)
 
-@pytest.fixture(scope="function")
-def test_user2_token(client, test_user2):
-    response = client.post(
-        "/token",
-        data={"username": "testuser2", "password": "testpassword"}
-    )
-    return response.json()["access_token"] 
\ No newline at end of file
+@pytest.fixture(scope="module")
+def test_user_token(test_user):
+    return token_for(test_user.id)
+
+@pytest.fixture(scope="module")
+def test_admin_token(test_admin):
+    return token_for(test_admin.id)
+
+@pytest.fixture(scope="module")
+def test_user2_token(test_user2):
+    return token_for(test_user2.id)
+
+@pytest.fixture(scope="module")
+def auth_headers(test_user_token):
+    return {"Authorization": f"Bearer {test_user_token}"}
+
+@pytest.fixture(scope="module")
+def auth_headers2(test_user2_token):
+    return {"Authorization": f"Bearer {test_user2_token}"}
@@ -1,8 +1,11 @@
 import pytest
 from fastapi import status
+from app.auth import auth
 
-def test_create_user(client):
-    response = client.post(
+pytestmark = pytest.mark.asyncio
+
+async def test_create_user(client):
+    response = await client.post(
         "/users/",
         json={
             "email": "newuser@example.com",
@@ -17,8 +20,8 @@ def test_create_user(client):
     assert "id" in data
     assert "hashed_password" not in data
 
-def test_create_user_duplicate_email(client, test_user):
-    response = client.post(
+async def test_create_user_duplicate_email(client, test_user):
+    response = await client.post(
         "/users/",
         json={
             "email": "test@example.com",
@@ -28,8 +31,8 @@ def test_create_user_duplicate_email(client, test_user):
     )
     assert response.status_code == status.HTTP_400_BAD_REQUEST
 
-def test_create_user_duplicate_username(client, test_user):
-    response = client.post(
+async def test_create_user_duplicate_username(client, test_user):
+    response = await client.post(
         "/users/",
         json={
             "email": "different@example.com",
@@ -39,8 +42,8 @@ def test_create_user_duplicate_username(client, test_user):
     )
     assert response.status_code == status.HTTP_400_BAD_REQUEST
 
-def test_login_success(client, test_user):
-    response = client.post(
+async def test_login_success(client, test_user):
+    response = await client.post(
         "/token",
         data={"username": "testuser", "password": "testpassword"}
     )
@@ -49,22 +52,22 @@ def test_login_success(client, test_user):
     assert "access_token" in data
     assert data["token_type"] == "bearer"
 
-def test_login_wrong_password(client, test_user):
-    response = client.post(
+async def test_login_wrong_password(client, test_user):
+    response = await client.post(
         "/token",
         data={"username": "testuser", "password": "wrongpassword"}
     )
     assert response.status_code == status.HTTP_401_UNAUTHORIZED
 
-def test_login_nonexistent_user(client):
-    response = client.post(
+async def test_login_nonexistent_user(client):
+    response = await client.post(
         "/token",
         data={"username": "nonexistent", "password": "password"}
     )
     assert response.status_code == status.HTTP_401_UNAUTHORIZED
 
-def test_get_current_user(client, test_user_token):
-    response = client.get(
+async def test_get_current_user(client, test_user_token):
+    response = await client.get(
         "/users/me",
         headers={"Authorization": f"Bearer {test_user_token}"}
     )
@@ -75,19 +78,19 @@ def test_get_current_user(client, test_user_token):
     assert "id" in data
     assert "hashed_password" not in data
 
-def test_get_current_user_no_token(client):
-    response = client.get("/users/me")
+async def test_get_current_user_no_token(client):
+    response = await client.get("/users/me")
     assert response.status_code == status.HTTP_401_UNAUTHORIZED
 
-def test_get_current_user_invalid_token(client):
-    response = client.get(
+async def test_get_current_user_invalid_token(client):
+    response = await client.get(
         "/users/me",
         headers={"Authorization": "Bearer invalid_token"}
     )
     assert response.status_code == status.HTTP_401_UNAUTHORIZED
 
-def test_get_user_by_id(client, test_user, test_user_token):
-    response = client.get(
+async def test_get_user_by_id(client, test_user, test_user_token):
+    response = await client.get(
         f"/users/{test_user.id}",
         headers={"Authorization": f"Bearer {test_user_token}"}
     )
@@ -98,13 +101,67 @@ def test_get_user_by_id(client, test_user, test_user_token):
     assert "id" in data
     assert "hashed_password" not in data
 
-def test_get_nonexistent_user(client, test_user_token):
-    response = client.get(
+async def test_get_nonexistent_user(client, test_user_token):
+    response = await client.get(
         "/users/999",
         headers={"Authorization": f"Bearer {test_user_token}"}
     )
     assert response.status_code == status.HTTP_404_NOT_FOUND
 
-def test_get_user_unauthorized(client, test_user):
-    response = client.get(f"/users/{test_user.id}")
-    assert response.status_code == status.HTTP_401_UNAUTHORIZED 
\ No newline at end of file
+async def test_get_user_unauthorized(client, test_user):
+    response = await client.get(f"/users/{test_user.id}")
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED 
+
+def cache_hit_for(user, **overrides):
+    """A cache_get stand-in returning the user's cached columns, as Redis would on a hit"""
+    cached = {
+        "id": user.id,
+        "email": user.email,
+        "username": user.username,
+        "is_active": user.is_active,
+        "is_admin": user.is_admin,
+        "created_at": user.created_at.isoformat() if user.created_at else None,
+        "auth_uuid": user.auth_uuid,
+        **overrides
+    }
+    return lambda key: dict(cached) if key == auth.user_cache_key(user.id) else None
+
+async def test_cached_user_is_attached_to_session(db_session, test_user, test_user_token, monkeypatch):
+    monkeypatch.setattr(auth, "cache_get", cache_hit_for(test_user))
+    user = auth.get_current_user(token=test_user_token, db=db_session)
+    assert user in db_session
+    # Columns that aren't cached are loaded on access rather than missing
+    assert user.hashed_password == test_user.hashed_password
+
+async def test_cached_inactive_user_rejected(client, test_user, test_user_token, monkeypatch):
+    monkeypatch.setattr(auth, "cache_get", cache_hit_for(test_user, is_active=False))
+    response = await client.get(
+        "/users/me",
+        headers={"Authorization": f"Bearer {test_user_token}"}
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+async def test_cached_admin_user_allowed(client, test_admin, test_admin_token, monkeypatch):
+    monkeypatch.setattr(auth, "cache_get", cache_hit_for(test_admin))
+    response = await client.get(
+        "/admin/users",
+        headers={"Authorization": f"Bearer {test_admin_token}"}
+    )
+    assert response.status_code == status.HTTP_200_OK
+
+async def test_cached_non_admin_user_forbidden(client, test_user, test_user_token, monkeypatch):
+    monkeypatch.setattr(auth, "cache_get", cache_hit_for(test_user))
+    response = await client.get(
+        "/admin/users",
+        headers={"Authorization": f"Bearer {test_user_token}"}
+    )
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+async def test_cached_admin_flag_rechecked(client, test_user, test_user_token, monkeypatch):
+    # A cache entry still saying is_admin after a demotion must not open admin routes
+    monkeypatch.setattr(auth, "cache_get", cache_hit_for(test_user, is_admin=True))
+    response = await client.get(
+        "/admin/users",
+        headers={"Authorization": f"Bearer {test_user_token}"}
+    )
+    assert response.status_code == status.HTTP_403_FORBIDDEN
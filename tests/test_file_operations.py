@@ -1,166 +1,201 @@
+import asyncio
 import pytest
 from fastapi import status
-import io
-
-def test_move_file(client, test_user_token):
-    # First create a folder
-    folder_response = client.post(
-        "/folders/",
-        headers={"Authorization": f"Bearer {test_user_token}"},
-        json={"filename": "test_folder"}
-    )
-    folder_id = folder_response.json()["id"]
-
-    # Upload a file
-    file_content = b"Test file content"
-    files = {
-        "file": ("test.txt", io.BytesIO(file_content), "text/plain")
-    }
-    upload_response = client.post(
-        "/files/upload",
-        headers={"Authorization": f"Bearer {test_user_token}"},
-        files=files
-    )
-    file_id = upload_response.json()["id"]
-
+from app import models
+from app.utils.s3_service import get_s3_service
+
+pytestmark = pytest.mark.asyncio
+
+# Move tests only need the rows to exist, so they are inserted directly rather
+# than through the multipart upload and folder endpoints
+
+@pytest.fixture
+def make_item(db_session):
+    def _make_item(owner, filename, item_type="file", parent_id=None, status="ready"):
+        item = models.File(
+            filename=filename,
+            file_path=f"uploads/{owner.id}/{filename}" if item_type == "file" else None,
+            file_size=17 if item_type == "file" else 0,
+            file_type="text/plain" if item_type == "file" else None,
+            owner_id=owner.id,
+            type=item_type,
+            parent_id=parent_id,
+            mime_type="text/plain" if item_type == "file" else "folder",
+            status=status
+        )
+        db_session.add(item)
+        db_session.commit()
+        return item.id
+    return _make_item
+
+@pytest.fixture
+def user_folder(make_item, test_user):
+    return make_item(test_user, "test_folder", item_type="folder")
+
+@pytest.fixture
+def uploaded_file(make_item, test_user):
+    return make_item(test_user, "test.txt")
+
+async def test_move_file(client, test_user_token, user_folder, uploaded_file):
     # Move file to folder
-    response = client.patch(
-        f"/files/{file_id}/move",
+    response = await client.patch(
+        f"/files/{uploaded_file}/move",
         headers={"Authorization": f"Bearer {test_user_token}"},
-        json={"target_parent_id": folder_id}
+        json={"target_parent_id": user_folder}
     )
     assert response.status_code == status.HTTP_200_OK
     data = response.json()
-    assert data["parent_id"] == folder_id
+    assert data["parent_id"] == user_folder
 
-def test_move_file_no_auth(client):
-    response = client.patch(
+async def test_move_file_no_auth(client):
+    response = await client.patch(
         "/files/1/move",
         json={"target_parent_id": 1}
     )
     assert response.status_code == status.HTTP_401_UNAUTHORIZED
 
-def test_move_file_unauthorized(client, test_user_token, test_user2_token):
-    # First create a folder with test_user
-    folder_response = client.post(
-        "/folders/",
-        headers={"Authorization": f"Bearer {test_user_token}"},
-        json={"filename": "test_folder"}
-    )
-    folder_id = folder_response.json()["id"]
-
-    # Upload a file with test_user2
-    file_content = b"Test file content"
-    files = {
-        "file": ("test.txt", io.BytesIO(file_content), "text/plain")
-    }
-    upload_response = client.post(
-        "/files/upload",
-        headers={"Authorization": f"Bearer {test_user2_token}"},
-        files=files
-    )
-    file_id = upload_response.json()["id"]
+async def test_move_file_unauthorized(client, test_user_token, user_folder, make_item, test_user2):
+    # A file owned by test_user2
+    file_id = make_item(test_user2, "test.txt")
 
     # Try to move file with test_user
-    response = client.patch(
+    response = await client.patch(
         f"/files/{file_id}/move",
         headers={"Authorization": f"Bearer {test_user_token}"},
-        json={"target_parent_id": folder_id}
+        json={"target_parent_id": user_folder}
     )
     assert response.status_code == status.HTTP_403_FORBIDDEN
 
-def test_move_file_to_nonexistent_folder(client, test_user_token):
-    # Upload a file
-    file_content = b"Test file content"
-    files = {
-        "file": ("test.txt", io.BytesIO(file_content), "text/plain")
-    }
-    upload_response = client.post(
-        "/files/upload",
-        headers={"Authorization": f"Bearer {test_user_token}"},
-        files=files
-    )
-    file_id = upload_response.json()["id"]
-
+async def test_move_file_to_nonexistent_folder(client, test_user_token, uploaded_file):
     # Try to move to nonexistent folder
-    response = client.patch(
-        f"/files/{file_id}/move",
+    response = await client.patch(
+        f"/files/{uploaded_file}/move",
         headers={"Authorization": f"Bearer {test_user_token}"},
         json={"target_parent_id": 999}
     )
     assert response.status_code == status.HTTP_404_NOT_FOUND
 
-def test_move_file_to_itself(client, test_user_token):
-    # First create a folder
-    folder_response = client.post(
-        "/folders/",
+async def test_move_file_to_itself(client, test_user_token, user_folder):
+    # Try to move folder into itself
+    response = await client.patch(
+        f"/files/{user_folder}/move",
         headers={"Authorization": f"Bearer {test_user_token}"},
-        json={"filename": "test_folder"}
+        json={"target_parent_id": user_folder}
     )
-    folder_id = folder_response.json()["id"]
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
 
-    # Try to move folder into itself
-    response = client.patch(
-        f"/files/{folder_id}/move",
+async def test_move_file_to_descendant(client, test_user_token, make_item, test_user):
+    # Create parent folder and a child folder inside it
+    parent_folder_id = make_item(test_user, "parent_folder", item_type="folder")
+    child_folder_id = make_item(test_user, "child_folder", item_type="folder", parent_id=parent_folder_id)
+
+    # Try to move parent folder into child folder
+    response = await client.patch(
+        f"/files/{parent_folder_id}/move",
         headers={"Authorization": f"Bearer {test_user_token}"},
-        json={"target_parent_id": folder_id}
+        json={"target_parent_id": child_folder_id}
     )
     assert response.status_code == status.HTTP_400_BAD_REQUEST
 
-def test_move_file_to_descendant(client, test_user_token):
-    # Create parent folder
-    parent_folder_response = client.post(
-        "/folders/",
+async def test_move_file_to_root(client, test_user_token, user_folder, make_item, test_user):
+    # A file inside the folder
+    file_id = make_item(test_user, "test.txt", parent_id=user_folder)
+
+    # Move file to root
+    response = await client.patch(
+        f"/files/{file_id}/move",
         headers={"Authorization": f"Bearer {test_user_token}"},
-        json={"filename": "parent_folder"}
+        json={"target_parent_id": None}
     )
-    parent_folder_id = parent_folder_response.json()["id"]
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert data["parent_id"] is None
 
-    # Create child folder
-    child_folder_response = client.post(
-        "/folders/",
-        headers={"Authorization": f"Bearer {test_user_token}"},
-        json={"filename": "child_folder", "parent_id": parent_folder_id}
+async def test_list_root_files(client, test_user_token, user_folder, make_item, test_user):
+    make_item(test_user, "nested.txt", parent_id=user_folder)
+    response = await client.get(
+        "/files/",
+        headers={"Authorization": f"Bearer {test_user_token}"}
     )
-    child_folder_id = child_folder_response.json()["id"]
+    assert response.status_code == status.HTTP_200_OK
+    assert [item["id"] for item in response.json()] == [user_folder]
 
-    # Try to move parent folder into child folder
-    response = client.patch(
-        f"/files/{parent_folder_id}/move",
-        headers={"Authorization": f"Bearer {test_user_token}"},
-        json={"target_parent_id": child_folder_id}
+async def test_delete_file(client, db_session, test_user_token, uploaded_file):
+    response = await client.delete(
+        f"/files/{uploaded_file}",
+        headers={"Authorization": f"Bearer {test_user_token}"}
     )
-    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.status_code == status.HTTP_200_OK
+    assert db_session.get(models.File, uploaded_file) is None
 
-def test_move_file_to_root(client, test_user_token):
-    # First create a folder
-    folder_response = client.post(
-        "/folders/",
+async def test_delete_file_unauthorized(client, test_user2_token, uploaded_file):
+    response = await client.delete(
+        f"/files/{uploaded_file}",
+        headers={"Authorization": f"Bearer {test_user2_token}"}
+    )
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+async def poll_status(client, file_id, token, attempts=10):
+    # Poll the file record the way a client would until the background upload settles
+    for _ in range(attempts):
+        response = await client.get(
+            f"/files/{file_id}",
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == status.HTTP_200_OK
+        if response.json()["status"] != "uploading":
+            break
+        await asyncio.sleep(0.05)
+    return response.json()["status"]
+
+async def test_upload_becomes_ready(client, test_user_token):
+    response = await client.post(
+        "/files/upload",
         headers={"Authorization": f"Bearer {test_user_token}"},
-        json={"filename": "test_folder"}
+        files={"file": ("test.txt", b"Test file content", "text/plain")}
     )
-    folder_id = folder_response.json()["id"]
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert response.json()["status"] == "uploading"
+    assert await poll_status(client, response.json()["id"], test_user_token) == "ready"
+
+async def test_upload_becomes_failed(client, test_user_token, monkeypatch):
+    def failing_upload(*args, **kwargs):
+        raise Exception("S3 is unavailable")
+    monkeypatch.setattr(get_s3_service(), "upload_file", failing_upload)
 
-    # Upload a file to the folder
-    file_content = b"Test file content"
-    files = {
-        "file": ("test.txt", io.BytesIO(file_content), "text/plain")
-    }
-    data = {"parent_id": folder_id}
-    upload_response = client.post(
+    response = await client.post(
         "/files/upload",
         headers={"Authorization": f"Bearer {test_user_token}"},
-        files=files,
-        data=data
+        files={"file": ("test.txt", b"Test file content", "text/plain")}
     )
-    file_id = upload_response.json()["id"]
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    file_id = response.json()["id"]
+    assert await poll_status(client, file_id, test_user_token) == "failed"
+    content_response = await client.get(
+        f"/files/{file_id}/content",
+        headers={"Authorization": f"Bearer {test_user_token}"}
+    )
+    assert content_response.status_code == status.HTTP_409_CONFLICT
 
-    # Move file to root
-    response = client.patch(
-        f"/files/{file_id}/move",
+@pytest.mark.parametrize("path", ["/files/{}/download", "/files/{}/content"])
+async def test_file_not_ready(client, test_user_token, make_item, test_user, path):
+    # A file whose S3 upload hasn't finished has no object to serve yet
+    file_id = make_item(test_user, "test.txt", status="uploading")
+    response = await client.get(
+        path.format(file_id),
+        headers={"Authorization": f"Bearer {test_user_token}"}
+    )
+    assert response.status_code == status.HTTP_409_CONFLICT
+
+async def test_preview_empty_text_file(client, test_user_token):
+    upload_response = await client.post(
+        "/files/upload",
         headers={"Authorization": f"Bearer {test_user_token}"},
-        json={"target_parent_id": None}
+        files={"file": ("empty.txt", b"", "text/plain")}
+    )
+    response = await client.get(
+        f"/files/{upload_response.json()['id']}/content",
+        headers={"Authorization": f"Bearer {test_user_token}"}
     )
     assert response.status_code == status.HTTP_200_OK
-    data = response.json()
-    assert data["parent_id"] is None 
\ No newline at end of file
+    assert response.json() == {"content": ""}
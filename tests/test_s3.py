@@ -3,6 +3,8 @@ from dotenv import load_dotenv
 import os
 import pytest
 
+pytestmark = pytest.mark.aws
+
     # Load environment variables
 load_dotenv()
     
@@ -1,61 +1,67 @@
 import pytest
 from fastapi.testclient import TestClient
 from app.main import app
-from app.utils.s3_service import S3Service
+from app.utils.s3_service import get_s3_service
 import os
 from dotenv import load_dotenv
 from app.auth import create_access_token
 from app.models import User
 from app.database import get_db, Base, engine
-from app.auth import get_password_hash
 import uuid
 import boto3
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
 
+# These tests use the real bucket and database
+pytestmark = pytest.mark.aws
+
 # Load environment variables
 load_dotenv()
 
-# Initialize test client and S3 service
-client = TestClient(app)
-s3_service = S3Service()
+# Use the app's process-wide S3 service instead of a second boto3 client
+s3_service = get_s3_service()
 
-# Create test database tables
-Base.metadata.create_all(bind=engine)
+@pytest.fixture(scope="module")
+def client():
+    """One TestClient for the module, so startup runs once and its event loop and
+    connection are reused across tests; overrides the per-test client in conftest.py"""
+    with TestClient(app) as test_client:
+        yield test_client
 
-@pytest.fixture(autouse=True)
-def cleanup_s3():
-    """Cleanup S3 bucket after each test"""
-    yield
-    try:
-        # List all objects in the bucket
-        response = s3_service.s3_client.list_objects_v2(Bucket=s3_service.bucket_name)
-        if 'Contents' in response:
-            # Delete all objects
-            objects_to_delete = [{'Key': obj['Key']} for obj in response['Contents']]
-            if objects_to_delete:
-                s3_service.s3_client.delete_objects(
-                    Bucket=s3_service.bucket_name,
-                    Delete={'Objects': objects_to_delete}
-                )
-    except Exception as e:
-        print(f"Error during cleanup: {str(e)}")
+@pytest.fixture(scope="module", autouse=True)
+def create_tables():
+    """Create the database tables once for the module rather than at import"""
+    Base.metadata.create_all(bind=engine)
 
-@pytest.fixture
-def test_user():
-    # Create a test user with a unique username/email
-    db = next(get_db())
+@pytest.fixture(scope="module")
+def test_user(create_tables, password_hashes):
+    # Create one test user with a unique username/email for the module; the
+    # tests go through the real app, so they only need a valid owner and token
+    db_gen = get_db()
+    db = next(db_gen)
     unique_id = str(uuid.uuid4())[:8]
     test_user = User(
         email=f"test_{unique_id}@example.com",
         username=f"testuser_{unique_id}",
-        hashed_password=get_password_hash("testpassword")
+        hashed_password=password_hashes["testpassword"]
     )
     db.add(test_user)
     db.commit()
     db.refresh(test_user)
-    return test_user
+    yield test_user
+    db_gen.close()
 
 @pytest.fixture
+def cleanup_s3(test_user):
+    """Delete the test user's uploads after a test, listing only their key prefix"""
+    prefix = s3_service.get_upload_key("", str(test_user.id))
+    yield prefix
+    try:
+        s3_service.delete_prefix(prefix)
+    except Exception as e:
+        print(f"Error during cleanup: {str(e)}")
+
+@pytest.fixture(scope="module")
 def test_user_token(test_user):
     # Create a token for the test user
     return create_access_token({"sub": test_user.id})
@@ -79,52 +85,37 @@ def test_s3_bucket_exists():
         else:
             assert False, f"Unexpected error: {str(e)}"
 
-def test_file_upload_to_s3(test_user_token):
+def test_file_upload_to_s3(client, test_user_token, cleanup_s3):
     """Test file upload to S3"""
-    # Create a test file
-    test_content = "This is a test file for S3 integration"
-    test_file_path = "test_upload.txt"
+    test_content = b"This is a test file for S3 integration"
     
     try:
         # Upload file to S3
-        with open(test_file_path, "w") as f:
-            f.write(test_content)
-        
-        with open(test_file_path, "rb") as f:
-            response = client.post(
-                "/files/upload",
-                files={"file": ("test_upload.txt", f, "text/plain")},
-                headers={"Authorization": f"Bearer {test_user_token}"}
-            )
+        response = client.post(
+            "/files/upload",
+            files={"file": ("test_upload.txt", test_content, "text/plain")},
+            headers={"Authorization": f"Bearer {test_user_token}"}
+        )
         
-        assert response.status_code == 200
+        assert response.status_code == 202
         data = response.json()
         assert data["name"] == "test_upload.txt"
         assert data["file_url"].startswith("https://")
         
-        # Clean up test file
-        os.remove(test_file_path)
-        
     except Exception as e:
         print(f"Error in test_file_upload_to_s3: {str(e)}")
         raise
 
-def test_file_download_from_s3(test_user_token):
+def test_file_download_from_s3(client, test_user_token, cleanup_s3):
     """Test file download from S3"""
     try:
         # First upload a file
-        test_content = "Test content for download"
-        test_file_path = "test_download.txt"
-        
-        with open(test_file_path, "w") as f:
-            f.write(test_content)
-        
-        with open(test_file_path, "rb") as f:
-            upload_response = client.post(
-                "/files/upload",
-                files={"file": ("test_download.txt", f, "text/plain")},
-                headers={"Authorization": f"Bearer {test_user_token}"}
-            )
+        test_content = b"Test content for download"
+        upload_response = client.post(
+            "/files/upload",
+            files={"file": ("test_download.txt", test_content, "text/plain")},
+            headers={"Authorization": f"Bearer {test_user_token}"}
+        )
         
         file_id = upload_response.json()["id"]
         
@@ -135,31 +126,22 @@ def test_file_download_from_s3(test_user_token):
         )
         
         assert download_response.status_code == 200
-        assert download_response.content.decode() == test_content
-        
-        # Clean up
-        os.remove(test_file_path)
+        assert download_response.content == test_content
         
     except Exception as e:
         print(f"Error in test_file_download_from_s3: {str(e)}")
         raise
 
-def test_file_delete_from_s3(test_user_token):
+def test_file_delete_from_s3(client, test_user_token, cleanup_s3):
     """Test file deletion from S3"""
     try:
         # First upload a file
-        test_content = "Test content for deletion"
-        test_file_path = "test_delete.txt"
-        
-        with open(test_file_path, "w") as f:
-            f.write(test_content)
-        
-        with open(test_file_path, "rb") as f:
-            upload_response = client.post(
-                "/files/upload",
-                files={"file": ("test_delete.txt", f, "text/plain")},
-                headers={"Authorization": f"Bearer {test_user_token}"}
-            )
+        test_content = b"Test content for deletion"
+        upload_response = client.post(
+            "/files/upload",
+            files={"file": ("test_delete.txt", test_content, "text/plain")},
+            headers={"Authorization": f"Bearer {test_user_token}"}
+        )
         
         file_id = upload_response.json()["id"]
         
@@ -185,35 +167,30 @@ def test_file_delete_from_s3(test_user_token):
             else:
                 raise
         
-        # Clean up
-        os.remove(test_file_path)
-        
     except Exception as e:
         print(f"Error in test_file_delete_from_s3: {str(e)}")
         raise
 
-def test_list_files(test_user_token):
+def test_list_files(client, test_user_token, cleanup_s3):
     """Test listing files from S3"""
     try:
         # Upload multiple test files
         test_files = [
-            ("test_file1.txt", "Content 1"),
-            ("test_file2.txt", "Content 2"),
-            ("test_file3.txt", "Content 3")
+            ("test_file1.txt", b"Content 1"),
+            ("test_file2.txt", b"Content 2"),
+            ("test_file3.txt", b"Content 3")
         ]
         
-        for filename, content in test_files:
-            with open(filename, "w") as f:
-                f.write(content)
-            
-            with open(filename, "rb") as f:
-                client.post(
-                    "/files/upload",
-                    files={"file": (filename, f, "text/plain")},
-                    headers={"Authorization": f"Bearer {test_user_token}"}
-                )
-            
-            os.remove(filename)
+        def upload(filename, content):
+            return client.post(
+                "/files/upload",
+                files={"file": (filename, content, "text/plain")},
+                headers={"Authorization": f"Bearer {test_user_token}"}
+            )
+        
+        # The uploads are independent, so send them concurrently
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda item: upload(*item), test_files))
         
         # Test listing files
         list_response = client.get(
@@ -227,9 +204,9 @@ def test_list_files(test_user_token):
         assert len(data) >= len(test_files)
         
         # Verify file names are in the response
-        file_names = [item["name"] for item in data]
-        for filename, _ in test_files:
-            assert filename in file_names
+        file_names = {item["name"] for item in data}
+        expected = {filename for filename, _ in test_files}
+        assert expected.issubset(file_names), f"Missing files: {expected - file_names}"
             
     except Exception as e:
         print(f"Error in test_list_files: {str(e)}")
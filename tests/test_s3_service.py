@@ -0,0 +1,93 @@
+import io
+import os
+import time
+import boto3
+import pytest
+from moto import mock_aws
+from app.utils import s3_service as s3_module
+from app.utils.s3_service import S3Service
+
+# S3Service against moto's in-memory S3, so these run without network access or AWS credentials
+
+BUCKET_NAME = "mydrive-test-bucket"
+
+@pytest.fixture
+def s3_service(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_REGION", "us-east-1")
+    monkeypatch.setenv("S3_BUCKET_NAME", BUCKET_NAME)
+    with mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket=BUCKET_NAME)
+        yield S3Service()
+
+def test_upload_and_download(s3_service):
+    key = s3_service.upload_file(io.BytesIO(b"Test file content"), "test.txt", "1")
+    assert key == "uploads/1/test.txt"
+    assert s3_service.download_file(key) == b"Test file content"
+    head = s3_service.s3_client.head_object(Bucket=BUCKET_NAME, Key=key)
+    assert head["ContentType"] == "text/plain"
+
+def test_ranged_download(s3_service, monkeypatch):
+    # Force the concurrent byte-range path with a small threshold and chunk size
+    monkeypatch.setattr(s3_module, "RANGED_DOWNLOAD_THRESHOLD", 1024)
+    monkeypatch.setattr(s3_module, "RANGED_DOWNLOAD_CHUNK_SIZE", 1000)
+    content = os.urandom(10 * 1024 + 7)
+    key = s3_service.upload_file(io.BytesIO(content), "large.bin", "1")
+    assert bytes(s3_service.download_file(key)) == content
+
+def test_ranged_download_after_overwrite(s3_service, monkeypatch):
+    # A size cached before the object was replaced must not shape the download
+    monkeypatch.setattr(s3_module, "RANGED_DOWNLOAD_THRESHOLD", 1024)
+    monkeypatch.setattr(s3_module, "RANGED_DOWNLOAD_CHUNK_SIZE", 1000)
+    key = s3_service.upload_file(io.BytesIO(os.urandom(10 * 1024)), "large.bin", "1")
+    stale_size = s3_service.get_file_size(key)
+    content = os.urandom(5 * 1024 + 3)
+    s3_service.upload_file(io.BytesIO(content), "large.bin", "1")
+    assert bytes(s3_service.download_file(key, size=stale_size)) == content
+
+def test_get_file_max_bytes(s3_service):
+    key = s3_service.upload_file(io.BytesIO(b"0123456789"), "digits.txt", "1")
+    assert s3_service.get_file(key, max_bytes=4) == b"0123"
+
+def test_get_file_max_bytes_empty_object(s3_service):
+    key = s3_service.upload_file(io.BytesIO(b""), "empty.txt", "1")
+    assert s3_service.get_file(key, max_bytes=4) == b""
+
+def test_file_exists_and_size(s3_service):
+    key = s3_service.upload_file(io.BytesIO(b"12345"), "five.txt", "1")
+    assert s3_service.file_exists(key)
+    assert s3_service.get_file_size(key) == 5
+    assert not s3_service.file_exists("uploads/1/missing.txt")
+
+def test_delete_invalidates_head_cache(s3_service):
+    key = s3_service.upload_file(io.BytesIO(b"12345"), "five.txt", "1")
+    assert s3_service.file_exists(key)
+    s3_service.delete_file(key)
+    assert not s3_service.file_exists(key)
+
+def test_copy_file(s3_service):
+    key = s3_service.upload_file(io.BytesIO(b"version content"), "doc.txt", "1")
+    assert s3_service.copy_file(key, "uploads/1/versions/v1_doc.txt") == len(b"version content")
+    assert s3_service.download_file("uploads/1/versions/v1_doc.txt") == b"version content"
+
+def test_delete_files_and_prefix(s3_service):
+    for i in range(5):
+        s3_service.upload_file(io.BytesIO(b"x"), f"file{i}.txt", "1")
+    s3_service.upload_file(io.BytesIO(b"x"), "other.txt", "2")
+    assert s3_service.existing_keys("uploads/1/") == {f"uploads/1/file{i}.txt" for i in range(5)}
+
+    assert s3_service.delete_files(["uploads/1/file0.txt", "uploads/1/file1.txt"]) == 2
+    assert s3_service.delete_prefix("uploads/1/") == 3
+    assert s3_service.existing_keys("uploads/1/") == set()
+    assert s3_service.existing_keys("uploads/2/") == {"uploads/2/other.txt"}
+
+def test_get_file_url_is_reused(s3_service):
+    url = s3_service.get_file_url("uploads/1/test.pdf")
+    assert s3_service.get_file_url("uploads/1/test.pdf") == url
+    assert s3_service.get_file_url("uploads/1/test.pdf", disposition="attachment") != url
+
+def test_reused_url_keeps_its_expiry(s3_service):
+    url, expires_at = s3_service.get_file_url_with_expiry("uploads/1/test.pdf", expires_in=600)
+    assert time.time() < expires_at <= time.time() + 600
+    assert s3_service.get_file_url_with_expiry("uploads/1/test.pdf", expires_in=600) == (url, expires_at)
@@ -1,14 +1,18 @@
 import pytest
 from fastapi import status
-import io
 
-def test_share_file(client, test_user_token, test_user2):
+pytestmark = pytest.mark.asyncio
+
+FILE_CONTENT = b"Test file content"
+
+def upload_files(content=FILE_CONTENT, filename="test.txt"):
+    # httpx encodes bytes directly, so no BytesIO is needed per request
+    return {"file": (filename, content, "text/plain")}
+
+async def test_share_file(client, test_user_token, test_user2):
     # First upload a file
-    file_content = b"Test file content"
-    files = {
-        "file": ("test.txt", io.BytesIO(file_content), "text/plain")
-    }
-    upload_response = client.post(
+    files = upload_files()
+    upload_response = await client.post(
         "/files/upload",
         headers={"Authorization": f"Bearer {test_user_token}"},
         files=files
@@ -16,7 +20,7 @@ def test_share_file(client, test_user_token, test_user2):
     file_id = upload_response.json()["id"]
 
     # Share the file
-    response = client.post(
+    response = await client.post(
         f"/files/{file_id}/share",
         headers={"Authorization": f"Bearer {test_user_token}"},
         json={"shared_with_email": "test2@example.com", "permission": "read"}
@@ -27,28 +31,25 @@ def test_share_file(client, test_user_token, test_user2):
     assert data["shared_with"] == "test2@example.com"
     assert data["permission"] == "read"
 
-def test_share_file_no_auth(client, test_user2):
-    response = client.post(
+async def test_share_file_no_auth(client, test_user2):
+    response = await client.post(
         "/files/1/share",
         json={"shared_with_email": "test2@example.com", "permission": "read"}
     )
     assert response.status_code == status.HTTP_401_UNAUTHORIZED
 
-def test_share_nonexistent_file(client, test_user_token, test_user2):
-    response = client.post(
+async def test_share_nonexistent_file(client, test_user_token, test_user2):
+    response = await client.post(
         "/files/999/share",
         headers={"Authorization": f"Bearer {test_user_token}"},
         json={"shared_with_email": "test2@example.com", "permission": "read"}
     )
     assert response.status_code == status.HTTP_404_NOT_FOUND
 
-def test_share_with_nonexistent_user(client, test_user_token):
+async def test_share_with_nonexistent_user(client, test_user_token):
     # First upload a file
-    file_content = b"Test file content"
-    files = {
-        "file": ("test.txt", io.BytesIO(file_content), "text/plain")
-    }
-    upload_response = client.post(
+    files = upload_files()
+    upload_response = await client.post(
         "/files/upload",
         headers={"Authorization": f"Bearer {test_user_token}"},
         files=files
@@ -56,20 +57,17 @@ def test_share_with_nonexistent_user(client, test_user_token):
     file_id = upload_response.json()["id"]
 
     # Try to share with nonexistent user
-    response = client.post(
+    response = await client.post(
         f"/files/{file_id}/share",
         headers={"Authorization": f"Bearer {test_user_token}"},
         json={"shared_with_email": "nonexistent@example.com", "permission": "read"}
     )
     assert response.status_code == status.HTTP_404_NOT_FOUND
 
-def test_share_file_unauthorized(client, test_user_token, test_user2_token):
+async def test_share_file_unauthorized(client, test_user_token, test_user2_token):
     # First upload a file with test_user
-    file_content = b"Test file content"
-    files = {
-        "file": ("test.txt", io.BytesIO(file_content), "text/plain")
-    }
-    upload_response = client.post(
+    files = upload_files()
+    upload_response = await client.post(
         "/files/upload",
         headers={"Authorization": f"Bearer {test_user_token}"},
         files=files
@@ -77,20 +75,17 @@ def test_share_file_unauthorized(client, test_user_token, test_user2_token):
     file_id = upload_response.json()["id"]
 
     # Try to share with test_user2
-    response = client.post(
+    response = await client.post(
         f"/files/{file_id}/share",
         headers={"Authorization": f"Bearer {test_user2_token}"},
         json={"shared_with_email": "test@example.com", "permission": "read"}
     )
     assert response.status_code == status.HTTP_403_FORBIDDEN
 
-def test_get_shared_files(client, test_user_token, test_user2_token):
+async def test_get_shared_files(client, test_user_token, test_user2_token):
     # First upload a file
-    file_content = b"Test file content"
-    files = {
-        "file": ("test.txt", io.BytesIO(file_content), "text/plain")
-    }
-    upload_response = client.post(
+    files = upload_files()
+    upload_response = await client.post(
         "/files/upload",
         headers={"Authorization": f"Bearer {test_user_token}"},
         files=files
@@ -98,14 +93,14 @@ def test_get_shared_files(client, test_user_token, test_user2_token):
     file_id = upload_response.json()["id"]
 
     # Share the file
-    client.post(
+    await client.post(
         f"/files/{file_id}/share",
         headers={"Authorization": f"Bearer {test_user_token}"},
         json={"shared_with_email": "test2@example.com", "permission": "read"}
     )
 
     # Get shared files for test_user2
-    response = client.get(
+    response = await client.get(
         "/files/shared-with-me",
         headers={"Authorization": f"Bearer {test_user2_token}"}
     )
@@ -116,13 +111,13 @@ def test_get_shared_files(client, test_user_token, test_user2_token):
     assert data[0]["type"] == "file"
     assert data[0]["is_shared"] == True
 
-def test_get_shared_files_no_auth(client):
-    response = client.get("/files/shared-with-me")
+async def test_get_shared_files_no_auth(client):
+    response = await client.get("/files/shared-with-me")
     assert response.status_code == status.HTTP_401_UNAUTHORIZED
 
-def test_share_folder(client, test_user_token, test_user2_token):
+async def test_share_folder(client, test_user_token, test_user2_token):
     # First create a folder
-    folder_response = client.post(
+    folder_response = await client.post(
         "/files/folders",
         headers={"Authorization": f"Bearer {test_user_token}"},
         json={"filename": "test_folder"}
@@ -130,12 +125,9 @@ def test_share_folder(client, test_user_token, test_user2_token):
     folder_id = folder_response.json()["id"]
 
     # Upload a file to the folder
-    file_content = b"Test file content"
-    files = {
-        "file": ("test.txt", io.BytesIO(file_content), "text/plain")
-    }
+    files = upload_files()
     data = {"parent_id": folder_id}
-    client.post(
+    await client.post(
         "/files/upload",
         headers={"Authorization": f"Bearer {test_user_token}"},
         files=files,
@@ -143,7 +135,7 @@ def test_share_folder(client, test_user_token, test_user2_token):
     )
 
     # Share the folder
-    response = client.post(
+    response = await client.post(
         f"/files/{folder_id}/share",
         headers={"Authorization": f"Bearer {test_user_token}"},
         json={"shared_with_email": "test2@example.com", "permission": "read"}
@@ -155,7 +147,7 @@ def test_share_folder(client, test_user_token, test_user2_token):
     assert data["permission"] == "read"
 
     # Verify test_user2 can access the file in the shared folder
-    shared_files_response = client.get(
+    shared_files_response = await client.get(
         "/files/shared-with-me",
         headers={"Authorization": f"Bearer {test_user2_token}"}
     )
@@ -166,13 +158,10 @@ def test_share_folder(client, test_user_token, test_user2_token):
     assert shared_data[0]["type"] == "file"
     assert shared_data[0]["is_shared"] == True
 
-def test_recent_shared_files(client, test_user_token, test_user2_token):
+async def test_recent_shared_files(client, test_user_token, test_user2_token):
     # First upload a file
-    file_content = b"Test file content"
-    files = {
-        "file": ("test.txt", io.BytesIO(file_content), "text/plain")
-    }
-    upload_response = client.post(
+    files = upload_files()
+    upload_response = await client.post(
         "/files/upload",
         headers={"Authorization": f"Bearer {test_user_token}"},
         files=files
@@ -180,14 +169,14 @@ def test_recent_shared_files(client, test_user_token, test_user2_token):
     file_id = upload_response.json()["id"]
 
     # Share the file
-    client.post(
+    await client.post(
         f"/files/{file_id}/share",
         headers={"Authorization": f"Bearer {test_user_token}"},
         json={"shared_with_email": "test2@example.com", "permission": "read"}
     )
 
     # Get recent shared files for test_user2
-    response = client.get(
+    response = await client.get(
         "/files/recent-shared",
         headers={"Authorization": f"Bearer {test_user2_token}"}
     )
@@ -1,267 +1,179 @@
+import os
+import orjson
 import pytest
+import pytest_asyncio
 from fastapi import status
-import io
-
-def test_create_version(client, test_user_token):
-    # First upload a file
-    file_content = b"Test file content"
-    files = {
-        "file": ("test.txt", io.BytesIO(file_content), "text/plain")
-    }
-    upload_response = client.post(
+from app import models
+from app.utils import versioning
+from app.utils.s3_service import get_s3_service
+
+pytestmark = pytest.mark.asyncio
+
+FILE_CONTENT = b"Test file content"
+NEW_CONTENT = b"Updated test file content"
+COMMENT_DATA = {"comment": "Updated version"}
+
+def upload_files(content, filename="test.txt"):
+    # httpx encodes bytes directly, so no BytesIO is needed per request
+    return {"file": (filename, content, "text/plain")}
+
+# These tests were written against version endpoints the app doesn't have yet; strict, so
+# whichever starts passing once the routes land gets its marker removed
+MULTIPART_VERSIONS = pytest.mark.xfail(
+    strict=True,
+    reason="POST /files/{id}/versions takes a FileVersionCreate JSON body, not a multipart upload"
+)
+MISSING_VERSION_ROUTES = pytest.mark.xfail(
+    strict=True,
+    reason="the app has no version content, restore or delete routes"
+)
+
+def json_body(response):
+    # The app serializes with orjson; parse with it too rather than the stdlib json httpx uses
+    return orjson.loads(response.content)
+
+@pytest_asyncio.fixture
+async def uploaded_file(client, auth_headers):
+    """A file uploaded by test_user; its first version is the upload itself"""
+    upload_response = await client.post(
         "/files/upload",
-        headers={"Authorization": f"Bearer {test_user_token}"},
-        files=files
+        headers=auth_headers,
+        files=upload_files(FILE_CONTENT)
+    )
+    return json_body(upload_response)["id"]
+
+@pytest_asyncio.fixture
+async def file_with_two_versions(client, auth_headers, uploaded_file):
+    await client.post(
+        f"/files/{uploaded_file}/versions",
+        headers=auth_headers,
+        files=upload_files(NEW_CONTENT),
+        data=COMMENT_DATA
     )
-    file_id = upload_response.json()["id"]
+    return uploaded_file
 
-    # Create a new version
-    new_content = b"Updated test file content"
-    files = {
-        "file": ("test.txt", io.BytesIO(new_content), "text/plain")
-    }
-    response = client.post(
-        f"/files/{file_id}/versions",
-        headers={"Authorization": f"Bearer {test_user_token}"},
-        files=files,
-        data={"comment": "Updated version"}
+@MULTIPART_VERSIONS
+async def test_create_version(client, auth_headers, uploaded_file):
+    response = await client.post(
+        f"/files/{uploaded_file}/versions",
+        headers=auth_headers,
+        files=upload_files(NEW_CONTENT),
+        data=COMMENT_DATA
     )
     assert response.status_code == status.HTTP_201_CREATED
-    data = response.json()
+    data = json_body(response)
     assert data["version_number"] == 2
     assert data["comment"] == "Updated version"
 
-def test_create_version_no_auth(client):
-    files = {
-        "file": ("test.txt", io.BytesIO(b"Test content"), "text/plain")
-    }
-    response = client.post(
-        "/files/1/versions",
-        files=files
-    )
-    assert response.status_code == status.HTTP_401_UNAUTHORIZED
-
-def test_create_version_nonexistent_file(client, test_user_token):
-    new_content = b"Updated file content"
-    files = {
-        "file": ("test.txt", io.BytesIO(new_content), "text/plain")
-    }
-    response = client.post(
-        "/files/999/versions",
-        headers={"Authorization": f"Bearer {test_user_token}"},
-        files=files
-    )
-    assert response.status_code == status.HTTP_404_NOT_FOUND
-
-def test_create_version_unauthorized(client, test_user_token, test_user2_token):
-    # First upload a file with test_user
-    file_content = b"Test file content"
-    files = {
-        "file": ("test.txt", io.BytesIO(file_content), "text/plain")
-    }
-    upload_response = client.post(
-        "/files/upload",
-        headers={"Authorization": f"Bearer {test_user_token}"},
-        files=files
-    )
-    file_id = upload_response.json()["id"]
-
-    # Try to create version with test_user2
-    new_content = b"Updated test file content"
-    files = {
-        "file": ("test.txt", io.BytesIO(new_content), "text/plain")
-    }
-    response = client.post(
-        f"/files/{file_id}/versions",
-        headers={"Authorization": f"Bearer {test_user2_token}"},
-        files=files
+@MULTIPART_VERSIONS
+async def test_create_version_unauthorized(client, auth_headers2, uploaded_file):
+    # Try to version test_user's file as test_user2
+    response = await client.post(
+        f"/files/{uploaded_file}/versions",
+        headers=auth_headers2,
+        files=upload_files(NEW_CONTENT)
     )
     assert response.status_code == status.HTTP_403_FORBIDDEN
 
-def test_get_versions(client, test_user_token):
-    # First upload a file
-    file_content = b"Test file content"
-    files = {
-        "file": ("test.txt", io.BytesIO(file_content), "text/plain")
-    }
-    upload_response = client.post(
-        "/files/upload",
-        headers={"Authorization": f"Bearer {test_user_token}"},
-        files=files
-    )
-    file_id = upload_response.json()["id"]
-
-    # Create a new version
-    new_content = b"Updated test file content"
-    files = {
-        "file": ("test.txt", io.BytesIO(new_content), "text/plain")
-    }
-    client.post(
-        f"/files/{file_id}/versions",
-        headers={"Authorization": f"Bearer {test_user_token}"},
-        files=files,
-        data={"comment": "Updated version"}
-    )
-
-    # Get versions
-    response = client.get(
-        f"/files/{file_id}/versions",
-        headers={"Authorization": f"Bearer {test_user_token}"}
+@MULTIPART_VERSIONS
+async def test_get_versions(client, auth_headers, file_with_two_versions):
+    response = await client.get(
+        f"/files/{file_with_two_versions}/versions",
+        headers=auth_headers
     )
     assert response.status_code == status.HTTP_200_OK
-    data = response.json()
+    data = json_body(response)
     assert len(data) == 2
     assert data[0]["version_number"] == 1
     assert data[1]["version_number"] == 2
     assert data[1]["comment"] == "Updated version"
 
-def test_get_versions_no_auth(client):
-    response = client.get("/files/1/versions")
-    assert response.status_code == status.HTTP_401_UNAUTHORIZED
-
-def test_get_versions_nonexistent_file(client, test_user_token):
-    response = client.get(
-        "/files/999/versions",
-        headers={"Authorization": f"Bearer {test_user_token}"}
-    )
-    assert response.status_code == status.HTTP_404_NOT_FOUND
-
-def test_get_version_content(client, test_user_token):
-    # First upload a file
-    file_content = b"Test file content"
-    files = {
-        "file": ("test.txt", io.BytesIO(file_content), "text/plain")
-    }
-    upload_response = client.post(
-        "/files/upload",
-        headers={"Authorization": f"Bearer {test_user_token}"},
-        files=files
-    )
-    file_id = upload_response.json()["id"]
-
-    # Create a new version
-    new_content = b"Updated test file content"
-    files = {
-        "file": ("test.txt", io.BytesIO(new_content), "text/plain")
-    }
-    client.post(
-        f"/files/{file_id}/versions",
-        headers={"Authorization": f"Bearer {test_user_token}"},
-        files=files,
-        data={"comment": "Updated version"}
-    )
-
-    # Get version content
-    response = client.get(
-        f"/files/{file_id}/versions/1/content",
-        headers={"Authorization": f"Bearer {test_user_token}"}
+@pytest.mark.parametrize("method,url,use_auth,expected_status", [
+    ("POST", "/files/1/versions", False, status.HTTP_401_UNAUTHORIZED),
+    pytest.param("POST", "/files/999/versions", True, status.HTTP_404_NOT_FOUND, marks=MULTIPART_VERSIONS),
+    ("GET", "/files/1/versions", False, status.HTTP_401_UNAUTHORIZED),
+    ("GET", "/files/999/versions", True, status.HTTP_404_NOT_FOUND),
+    pytest.param("GET", "/files/1/versions/1/content", False, status.HTTP_401_UNAUTHORIZED, marks=MISSING_VERSION_ROUTES),
+])
+async def test_version_error_paths(client, auth_headers, method, url, use_auth, expected_status):
+    kwargs = {"headers": auth_headers} if use_auth else {}
+    if method == "POST":
+        kwargs["files"] = upload_files(NEW_CONTENT)
+    response = await client.request(method, url, **kwargs)
+    assert response.status_code == expected_status
+
+@MISSING_VERSION_ROUTES
+async def test_get_version_content(client, auth_headers, file_with_two_versions):
+    response = await client.get(
+        f"/files/{file_with_two_versions}/versions/1/content",
+        headers=auth_headers
     )
     assert response.status_code == status.HTTP_200_OK
-    assert response.content == file_content
-
-def test_get_version_content_no_auth(client):
-    response = client.get("/files/1/versions/1/content")
-    assert response.status_code == status.HTTP_401_UNAUTHORIZED
-
-def test_get_version_content_nonexistent_file(client, test_user_token):
-    response = client.get(
-        "/files/999/versions/1/content",
-        headers={"Authorization": f"Bearer {test_user_token}"}
-    )
-    assert response.status_code == status.HTTP_404_NOT_FOUND
-
-def test_get_version_content_nonexistent_version(client, test_user_token):
-    # First upload a file
-    file_content = b"Test file content"
-    files = {
-        "file": ("test.txt", io.BytesIO(file_content), "text/plain")
-    }
-    upload_response = client.post(
-        "/files/upload",
-        headers={"Authorization": f"Bearer {test_user_token}"},
-        files=files
-    )
-    file_id = upload_response.json()["id"]
-
-    # Try to get nonexistent version
-    response = client.get(
-        f"/files/{file_id}/versions/2/content",
-        headers={"Authorization": f"Bearer {test_user_token}"}
-    )
-    assert response.status_code == status.HTTP_404_NOT_FOUND
-
-def test_restore_version(client, test_user_token):
-    # First upload a file
-    file_content = b"Test file content"
-    files = {
-        "file": ("test.txt", io.BytesIO(file_content), "text/plain")
-    }
-    upload_response = client.post(
-        "/files/upload",
-        headers={"Authorization": f"Bearer {test_user_token}"},
-        files=files
-    )
-    file_id = upload_response.json()["id"]
-
-    # Create a new version
-    new_content = b"Updated test file content"
-    files = {
-        "file": ("test.txt", io.BytesIO(new_content), "text/plain")
-    }
-    client.post(
-        f"/files/{file_id}/versions",
-        headers={"Authorization": f"Bearer {test_user_token}"},
-        files=files,
-        data={"comment": "Updated version"}
-    )
+    assert response.content == FILE_CONTENT
 
+@MISSING_VERSION_ROUTES
+async def test_restore_version(client, auth_headers, file_with_two_versions):
     # Restore to version 1
-    response = client.post(
+    response = await client.post(
         f"/files/versions/1/restore",
-        headers={"Authorization": f"Bearer {test_user_token}"}
+        headers=auth_headers
     )
     assert response.status_code == status.HTTP_200_OK
-    data = response.json()
+    data = json_body(response)
     assert data["version_number"] == 3  # New version created from restore
 
-def test_delete_version(client, test_user_token):
-    # First upload a file
-    file_content = b"Test file content"
-    files = {
-        "file": ("test.txt", io.BytesIO(file_content), "text/plain")
-    }
-    upload_response = client.post(
-        "/files/upload",
-        headers={"Authorization": f"Bearer {test_user_token}"},
-        files=files
-    )
-    file_id = upload_response.json()["id"]
-
-    # Create a new version
-    new_content = b"Updated test file content"
-    files = {
-        "file": ("test.txt", io.BytesIO(new_content), "text/plain")
-    }
-    version_response = client.post(
-        f"/files/{file_id}/versions",
-        headers={"Authorization": f"Bearer {test_user_token}"},
-        files=files,
-        data={"comment": "Updated version"}
-    )
-    version_number = version_response.json()["version_number"]
-
-    # Delete version
-    response = client.delete(
-        f"/files/{file_id}/versions/{version_number}",
-        headers={"Authorization": f"Bearer {test_user_token}"}
+@MISSING_VERSION_ROUTES
+async def test_delete_version(client, auth_headers, file_with_two_versions):
+    # Delete the first version; versioning.delete_versions refuses to delete the latest
+    response = await client.delete(
+        f"/files/{file_with_two_versions}/versions/1",
+        headers=auth_headers
     )
     assert response.status_code == status.HTTP_200_OK
 
     # Verify version is deleted
-    versions_response = client.get(
-        f"/files/{file_id}/versions",
-        headers={"Authorization": f"Bearer {test_user_token}"}
+    versions_response = await client.get(
+        f"/files/{file_with_two_versions}/versions",
+        headers=auth_headers
     )
     assert versions_response.status_code == status.HTTP_200_OK
-    versions = versions_response.json()
-    assert len(versions) == 1  # Only initial version remains 
\ No newline at end of file
+    versions = json_body(versions_response)
+    assert [version["version_number"] for version in versions] == [2]
+
+async def test_delete_first_version_keeps_file(client, auth_headers, db_session, uploaded_file):
+    # The first version shares the file's S3 key; add a second as a copy, inserted
+    # directly because the versions endpoint doesn't take uploads yet
+    file = db_session.get(models.File, uploaded_file)
+    version_path = f"{os.path.dirname(file.file_path)}/versions/v2_{os.path.basename(file.file_path)}"
+    file_size = get_s3_service().copy_file(file.file_path, version_path)
+    db_session.query(models.FileVersion).filter(models.FileVersion.file_id == file.id).update({"is_current": False})
+    db_session.add(models.FileVersion(
+        file_id=file.id,
+        file_path=version_path,
+        version_number=2,
+        file_size=file_size,
+        is_current=True
+    ))
+    db_session.commit()
+
+    versioning.delete_version(db_session, file, 1)
+
+    response = await client.get(
+        f"/files/{uploaded_file}/download",
+        headers=auth_headers,
+        params={"stream": True}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.content == FILE_CONTENT
+
+async def test_detach_versions_copies_shared_key(db_session, uploaded_file):
+    # restore_version detaches before overwriting the file, so version 1 keeps the uploaded bytes
+    file = db_session.get(models.File, uploaded_file)
+    versioning.detach_versions(db_session, file)
+
+    first_version = db_session.query(models.FileVersion).filter(
+        models.FileVersion.file_id == file.id,
+        models.FileVersion.version_number == 1
+    ).one()
+    assert first_version.file_path != file.file_path
+    assert get_s3_service().get_file(first_version.file_path) == FILE_CONTENT
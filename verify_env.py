@@ -1,32 +1,33 @@
 import os
+import sys
 from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv()
+# Required variables, grouped by the section they are reported under
+SECTIONS = (
+    (None, ("JWT_SECRET_KEY", "SECRET_KEY")),
+    ("AWS Configuration:", ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_REGION", "S3_BUCKET_NAME")),
+    ("Database Configuration:", ("DATABASE_URL",)),
+)
+REQUIRED_KEYS = tuple(key for _, keys in SECTIONS for key in keys)
 
-print("\nVerifying Environment Variables:")
-print("-" * 30)
+def check_env(file=sys.stdout) -> bool:
+    """Report which required environment variables are set; returns True if all are"""
+    # Only parse .env if nothing has loaded it into the environment yet
+    if os.getenv("JWT_SECRET_KEY") is None:
+        load_dotenv(override=False)
 
-# Check JWT Configuration
-jwt_key = os.getenv("JWT_SECRET_KEY")
-secret_key = os.getenv("SECRET_KEY")
-print(f"JWT_SECRET_KEY loaded: {'Yes' if jwt_key else 'No'}")
-print(f"SECRET_KEY loaded: {'Yes' if secret_key else 'No'}")
-print(f"Keys match: {'Yes' if jwt_key == secret_key else 'No'}")
+    env = os.environ
+    lines = ["\nVerifying Environment Variables:", "-" * 30]
+    for title, keys in SECTIONS:
+        if title:
+            lines.append(f"\n{title}")
+        lines.extend(f"{key} loaded: {'Yes' if env.get(key) else 'No'}" for key in keys)
+        if "SECRET_KEY" in keys:
+            lines.append(f"Keys match: {'Yes' if env.get('JWT_SECRET_KEY') == env.get('SECRET_KEY') else 'No'}")
 
-# Check AWS Configuration
-aws_access = os.getenv("AWS_ACCESS_KEY_ID")
-aws_secret = os.getenv("AWS_SECRET_ACCESS_KEY")
-aws_region = os.getenv("AWS_REGION")
-s3_bucket = os.getenv("S3_BUCKET_NAME")
+    # Write the whole report at once
+    file.write("\n".join(lines) + "\n")
+    return all(env.get(key) for key in REQUIRED_KEYS)
 
-print("\nAWS Configuration:")
-print(f"AWS_ACCESS_KEY_ID loaded: {'Yes' if aws_access else 'No'}")
-print(f"AWS_SECRET_ACCESS_KEY loaded: {'Yes' if aws_secret else 'No'}")
-print(f"AWS_REGION loaded: {'Yes' if aws_region else 'No'}")
-print(f"S3_BUCKET_NAME loaded: {'Yes' if s3_bucket else 'No'}")
-
-# Check Database Configuration
-db_url = os.getenv("DATABASE_URL")
-print("\nDatabase Configuration:")
-print(f"DATABASE_URL loaded: {'Yes' if db_url else 'No'}") 
\ No newline at end of file
+if __name__ == "__main__":
+    check_env()